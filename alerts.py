@@ -0,0 +1,135 @@
+import bisect
+from ratelimit import TokenBucket
+from batching import BatchWorker
+
+ABOVE = "above"
+BELOW = "below"
+MAX_ALERTS_PER_USER = 10
+
+
+class AlertBook:
+    # Open alerts indexed per company as sorted (threshold, alert_id) lists, one per direction.
+    # A price move pops every triggered alert as a prefix (above) or suffix (below) found by one bisect.
+    def __init__(self):
+        self.alerts = {}  # alert_id -> (user_id, company_name, direction, threshold)
+        self.thresholds = {}  # company_name -> {ABOVE: [(threshold, alert_id)], BELOW: [...]}
+        self.by_user = {}  # user_id -> number of open alerts
+
+    def load(self, rows):
+        # rows: (alert_id, user_id, company_name, direction, threshold)
+        self.alerts = {}
+        self.thresholds = {}
+        self.by_user = {}
+        for row in rows:
+            self.add(*row)
+
+    def add(self, alert_id: int, user_id, company_name: str, direction: str, threshold: float):
+        self.alerts[alert_id] = (str(user_id), company_name, direction, threshold)
+        self.by_user[str(user_id)] = self.by_user.get(str(user_id), 0) + 1
+        sides = self.thresholds.setdefault(company_name, {ABOVE: [], BELOW: []})
+        bisect.insort(sides[direction], (threshold, alert_id))
+
+    def remove(self, alert_id: int):
+        alert = self.alerts.pop(alert_id, None)
+        if alert is None:
+            return None
+        user_id, company_name, direction, threshold = alert
+        self._forget(user_id)
+        entries = self.thresholds[company_name][direction]
+        index = bisect.bisect_left(entries, (threshold, alert_id))
+        if index < len(entries) and entries[index] == (threshold, alert_id):
+            del entries[index]
+        return alert
+
+    def remove_company(self, company_name: str):
+        sides = self.thresholds.pop(company_name, None)
+        if sides:
+            for entries in sides.values():
+                for _, alert_id in entries:
+                    alert = self.alerts.pop(alert_id, None)
+                    if alert:
+                        self._forget(alert[0])
+
+    def check(self, company_name: str, price: float):
+        # Pops and returns [(alert_id, user_id, company_name, direction, threshold, price)] crossed by price
+        sides = self.thresholds.get(company_name)
+        if not sides:
+            return []
+        above, below = sides[ABOVE], sides[BELOW]
+        cut = bisect.bisect_right(above, (price, float("inf")))
+        hit = above[:cut]
+        del above[:cut]
+        cut = bisect.bisect_left(below, (price, float("-inf")))
+        hit += below[cut:]
+        del below[cut:]
+
+        triggered = []
+        for threshold, alert_id in hit:
+            user_id, _, direction, _ = self.alerts.pop(alert_id)
+            self._forget(user_id)
+            triggered.append((alert_id, user_id, company_name, direction, threshold, price))
+        return triggered
+
+    def _forget(self, user_id: str):
+        left = self.by_user.get(user_id, 0) - 1
+        if left > 0:
+            self.by_user[user_id] = left
+        else:
+            self.by_user.pop(user_id, None)
+
+    def count(self, user_id):
+        # Open alerts only; a fired alert stops counting before its row is deleted
+        return self.by_user.get(str(user_id), 0)
+
+    def __len__(self):
+        return len(self.alerts)
+
+
+def format_alert(alert):
+    _, _, company_name, direction, threshold, price = alert
+    return f"**{company_name}** is now {price:,} ({direction} your alert at {threshold:,})"
+
+
+class AlertNotifier:
+    def __init__(self, resolve_user, delete_alerts, batch_size: int = 100, flush_interval: float = 1.0, rate: TokenBucket = None):
+        self.resolve_user = resolve_user  # async user_id -> object with .send, or None
+        self.delete_alerts = delete_alerts  # async [alert_id] -> None; fired alerts are one-shot
+        self.rate = rate or TokenBucket(5, 5.0)  # Stay well inside Discord's DM rate limits
+        self.worker = BatchWorker(self._flush, batch_size, flush_interval, "send price alerts")
+        self.undeleted = []  # Fired alert ids whose rows couldn't be deleted yet; retried with the next batch
+
+    def start(self):
+        self.worker.start()
+
+    async def stop(self):
+        await self.worker.stop()
+
+    def notify(self, alerts):
+        for alert in alerts:
+            self.worker.put(alert)
+
+    async def _flush(self, batch):
+        # The DMs go out first; clearing the rows is its own step, so a failed delete can't
+        # swallow them. Rows left behind would only fire again after a restart.
+        await self._send(batch)
+        alert_ids = self.undeleted + [alert[0] for alert in batch]
+        try:
+            await self.delete_alerts(alert_ids)
+            self.undeleted = []
+        except Exception as e:
+            self.undeleted = alert_ids
+            print(f"Could not delete {len(alert_ids)} fired price alert(s), will retry: {e}")
+
+    async def _send(self, batch):
+        # One DM per user per batch, however many of their alerts fired
+        by_user = {}
+        for alert in batch:
+            by_user.setdefault(alert[1], []).append(alert)
+        for user_id, alerts in by_user.items():
+            await self.rate.acquire()
+            try:
+                user = await self.resolve_user(int(user_id))
+                if user:
+                    await user.send("Price alert:\n" + "\n".join(format_alert(alert) for alert in alerts))
+            except Exception as e:
+                print(f"Could not DM price alert to {user_id}: {e}")
@@ -0,0 +1,123 @@
+import math
+
+# NumPy is imported inside each function so loading this module stays cheap at startup
+
+SMA_WINDOW = 20  # Points, not minutes: each period's history has its own resolution
+EMA_SPAN = 20
+OVERLAYS = ("sma", "ema", "both")
+
+
+def sma(prices, window: int = SMA_WINDOW):
+    # Simple moving average from one cumulative sum; the first window-1 points are NaN
+    import numpy as np
+    prices = np.asarray(prices, dtype=float)
+    out = np.full(len(prices), np.nan)
+    window = max(1, min(window, len(prices)))
+    if len(prices):
+        csum = np.cumsum(np.concatenate(([0.0], prices)))
+        out[window - 1:] = (csum[window:] - csum[:-window]) / window
+    return out
+
+
+def ema(prices, span: int = EMA_SPAN):
+    # y[t] = a * x[t] + (1 - a) * y[t-1], seeded with x[0], solved in closed form block by block:
+    # y[j] = d^j * (d * y_prev + a * cumsum(x[i] / d^i)[j]) with d = 1 - a. Blocks keep d^-i from overflowing.
+    import numpy as np
+    prices = np.asarray(prices, dtype=float)
+    out = np.empty(len(prices))
+    if not len(prices):
+        return out
+    alpha = 2.0 / (max(1, span) + 1)
+    decay = 1.0 - alpha
+    if decay == 0.0:
+        out[:] = prices
+        return out
+
+    block = max(1, int(50 / -math.log10(decay)))
+    powers = decay ** np.arange(min(block, len(prices)))
+    previous = prices[0]
+    for start in range(0, len(prices), block):
+        chunk = prices[start:start + block]
+        scale = powers[:len(chunk)]
+        out[start:start + len(chunk)] = scale * (decay * previous + alpha * np.cumsum(chunk / scale))
+        previous = out[start + len(chunk) - 1]
+    return out
+
+
+def returns(prices):
+    import numpy as np
+    prices = np.asarray(prices, dtype=float)
+    if len(prices) < 2:
+        return np.empty(0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        changes = np.diff(prices) / prices[:-1]
+    return changes[np.isfinite(changes)]
+
+
+def max_drawdown(prices):
+    # Largest fall from a running peak, as a negative fraction
+    import numpy as np
+    prices = np.asarray(prices, dtype=float)
+    if not len(prices):
+        return 0.0
+    peaks = np.maximum.accumulate(prices)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        drawdowns = np.where(peaks > 0, prices / peaks - 1.0, 0.0)
+    return float(drawdowns.min())
+
+
+def summarize(prices, sma_window: int = SMA_WINDOW, ema_span: int = EMA_SPAN):
+    import numpy as np
+    prices = np.asarray(prices, dtype=float)
+    first, last = prices[0], prices[-1]
+    changes = returns(prices)
+    return {
+        "points": len(prices),
+        "first": round(float(first), 2),
+        "last": round(float(last), 2),
+        "high": round(float(prices.max()), 2),
+        "low": round(float(prices.min()), 2),
+        "change_pct": round(float((last - first) / first * 100), 2) if first else 0.0,
+        "sma": round(float(sma(prices, sma_window)[-1]), 2),
+        "ema": round(float(ema(prices, ema_span)[-1]), 2),
+        "volatility_pct": round(float(changes.std() * 100), 2) if len(changes) else 0.0,  # Std of point-to-point returns
+        "max_drawdown_pct": round(max_drawdown(prices) * 100, 2)
+    }
+
+
+def overlay_series(prices, overlay: str):
+    # {legend label: series aligned with prices} for create_and_save_graph
+    if overlay not in OVERLAYS:
+        return {}
+    series = {}
+    if overlay in ("sma", "both"):
+        series[f"SMA({SMA_WINDOW})"] = sma(prices)
+    if overlay in ("ema", "both"):
+        series[f"EMA({EMA_SPAN})"] = ema(prices)
+    return series
+
+
+class Analytics:
+    def __init__(self):
+        # (company, period, snapshot_ts) -> summary. Keyed by the tick the history was read at,
+        # so a result computed from a read that a tick overtook can never be served as current.
+        self._cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_cached(self, company_name: str, period: str, snapshot_ts):
+        result = self._cache.get((company_name, period, snapshot_ts))
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def compute(self, company_name: str, period: str, snapshot_ts, prices):
+        result = self._cache[(company_name, period, snapshot_ts)] = summarize(prices)
+        return result
+
+    def invalidate(self, snapshot_ts=None):
+        # Drops results from before snapshot_ts' tick; with no tick given, everything
+        self._cache = {key: result for key, result in self._cache.items()
+                       if snapshot_ts is not None and key[2] == snapshot_ts}
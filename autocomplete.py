@@ -0,0 +1,63 @@
+import bisect
+import difflib
+
+MAX_CHOICES = 25  # Discord shows at most 25 autocomplete choices
+MIN_FUZZY_LENGTH = 3  # Shorter queries are too ambiguous to guess a typo from
+
+
+class NameIndex:
+    # Case-insensitive index of names for autocomplete: a sorted key list answers prefixes
+    # with a bisect, substrings fill in after them, and difflib catches typos
+    def __init__(self, names=()):
+        self.keys = []  # Sorted lowercase names
+        self.names = {}  # lowercase -> name as registered
+        for name in names:
+            self.add(name)
+
+    def add(self, name: str):
+        key = name.lower()
+        if key not in self.names:
+            bisect.insort(self.keys, key)
+        self.names[key] = name
+
+    def remove(self, name: str):
+        key = name.lower()
+        if self.names.pop(key, None) is not None:
+            del self.keys[bisect.bisect_left(self.keys, key)]
+
+    def search(self, query: str, limit: int = MAX_CHOICES):
+        query = query.strip().lower()
+        if not query:
+            return [self.names[key] for key in self.keys[:limit]]
+
+        # Prefix matches first, in alphabetical order
+        matches = []
+        start = bisect.bisect_left(self.keys, query)
+        for key in self.keys[start:start + limit]:
+            if not key.startswith(query):
+                break
+            matches.append(key)
+
+        if len(matches) < limit:
+            seen = set(matches)
+            for key in self.keys:
+                if query in key and key not in seen:
+                    matches.append(key)
+                    seen.add(key)
+                    if len(matches) >= limit:
+                        break
+        if not matches and len(query) >= MIN_FUZZY_LENGTH:
+            # Nothing contains the text as typed: most likely a typo. Only names sharing the
+            # first two letters (or failing that, the first) are compared, not the whole index.
+            candidates = self._starting_with(query[:2]) or self._starting_with(query[0])
+            matches = difflib.get_close_matches(query, candidates, n=limit, cutoff=0.6)
+
+        return [self.names[key] for key in matches]
+
+    def _starting_with(self, prefix: str):
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + "\U0010ffff", start)
+        return self.keys[start:end]
+
+    def __len__(self):
+        return len(self.keys)
@@ -0,0 +1,53 @@
+import asyncio
+
+
+class BatchWorker:
+    # Queue drained by one background task: items are handed to flush in batches of up to
+    # batch_size, or whatever arrived within flush_interval of the first one
+    def __init__(self, flush, batch_size: int, flush_interval: float, description: str):
+        self.flush = flush  # async [item] -> None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.description = description  # For the error log, e.g. "send price alerts"
+        self.queue = asyncio.Queue()
+        self._worker = None
+
+    def start(self):
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Drain whatever is queued before shutting down
+        if self._worker is None:
+            return
+        await self.queue.join()
+        self._worker.cancel()
+        self._worker = None
+
+    def put(self, item):
+        self.queue.put_nowait(item)
+
+    async def _next_batch(self):
+        batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self.flush(batch)
+            except Exception as e:
+                print(f"Failed to {self.description}: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
@@ -0,0 +1,287 @@
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+# main.py reads these at import time; the bench never connects to Discord
+os.environ.setdefault('AUTHORIZED_ROLE_ID', '0')
+os.environ.setdefault('TOKEN', 'bench')
+
+from aiohttp import web
+import main
+from db import DatabaseUser, ROLLUPS
+from pnw import PnWClient
+
+PERIODS = ["1h", "12h", "1d", "3d", "7d"]
+
+
+# Minimal stand-ins for the parts of discord.Interaction the handlers touch
+class FakeResponse:
+    def __init__(self):
+        self.messages = []
+        self.rejections = []  # Ephemeral replies; the benched handlers only send those on errors
+        self.deferred = False
+
+    async def send_message(self, content=None, **kwargs):
+        self.messages.append(content if content is not None else kwargs)
+        if kwargs.get("ephemeral"):
+            self.rejections.append(content)
+
+    async def defer(self, **kwargs):
+        self.deferred = True
+
+    async def edit_message(self, **kwargs):
+        self.messages.append(kwargs)
+
+    def is_done(self):
+        return self.deferred or bool(self.messages)
+
+
+class FakeFollowup:
+    def __init__(self):
+        self.messages = []
+        self.rejections = []
+
+    async def send(self, content=None, **kwargs):
+        self.messages.append(content if content is not None else kwargs)
+        if kwargs.get("ephemeral"):
+            self.rejections.append(content)
+
+
+class FakeUser:
+    def __init__(self, user_id: int, name: str = "bench", roles=()):
+        self.id = user_id
+        self.name = name
+        self.roles = list(roles)
+        self.mention = f"<@{user_id}>"
+
+
+class FakeInteraction:
+    def __init__(self, user_id: int):
+        self.user = FakeUser(user_id)
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+
+    @property
+    def rejection(self):
+        # The first error reply the handler sent, if any
+        rejections = self.response.rejections + self.followup.rejections
+        return rejections[0] if rejections else None
+
+
+class FakeChannel:
+    async def send(self, content=None, **kwargs):
+        pass
+
+
+async def start_pnw_stub(port: int):
+    # Answers nation lookups locally so /who exercises the client without the real API
+    async def graphql(request):
+        await request.json()
+        await asyncio.sleep(0.005)  # A little network-like latency
+        return web.json_response({"data": {"nations": {"data": [
+            {"id": "1", "nation_name": "Bench Nation", "discord": "bench"}
+        ]}}})
+
+    app = web.Application()
+    app.router.add_post("/graphql", graphql)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+async def generate(db: DatabaseUser, users: int, companies: int, days: float, holdings: int, trades: int):
+    rng = random.Random(42)
+    user_ids = [str(10 ** 17 + i) for i in range(users)]
+    names = [f"CO{i:04d}" for i in range(companies)]
+    now = int(time.time()) // 60 * 60
+
+    async with db.pool.writer() as conn:
+        await conn.executemany(
+            "INSERT INTO users (user_id, nation_id, credits) VALUES (?, ?, ?)",
+            [(user_id, str(i + 1), rng.randint(10_000, 1_000_000)) for i, user_id in enumerate(user_ids)]
+        )
+        companies_rows = [(name, round(rng.uniform(5, 500), 2), rng.randint(10_000, 100_000), rng.choice(user_ids)) for name in names]
+        await conn.executemany("INSERT INTO companies (company_name, share_price, user_id) VALUES (?, ?, ?)",
+                               [(name, price, owner) for name, price, _, owner in companies_rows])
+        await conn.executemany("INSERT INTO total_shares (company_name, total_shares) VALUES (?, ?)",
+                               [(name, total) for name, _, total, _ in companies_rows])
+        await conn.executemany("INSERT INTO registered_shares (company_name, registered_share) VALUES (?, ?)",
+                               [(name, total) for name, _, total, _ in companies_rows])
+        await conn.executemany(
+            "INSERT OR IGNORE INTO user_shares (user_id, company_name, shares) VALUES (?, ?, ?)",
+            [(user_id, name, rng.randint(1, 500)) for user_id in user_ids for name in rng.sample(names, min(holdings, companies))]
+        )
+        await conn.executemany(
+            "INSERT INTO trades (company_name, seller_id, shares_available, price_per_share, side, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [(rng.choice(names), rng.choice(user_ids), rng.randint(1, 50), round(rng.uniform(5, 500), 2), rng.choice(["ask", "bid"]), now)
+             for _ in range(trades)]
+        )
+
+        # Minute ticks as a random walk per company
+        ticks = int(days * 1440)
+        for name, price, _, _ in companies_rows:
+            rows = []
+            for minute in range(ticks, 0, -1):
+                price = max(0.01, round(price * (1 + rng.gauss(0, 0.002)), 2))
+                rows.append((name, now - minute * 60, price))
+            await conn.executemany("INSERT OR IGNORE INTO share_price_history (company_name, ts, share_price) VALUES (?, ?, ?)", rows)
+
+        for name in ROLLUPS:
+            await conn.execute(f"DELETE FROM share_price_rollup_{name}")
+            await db._backfill_rollup(conn, name)
+
+    # Synthetic balances bypass the ledger; make them its opening snapshot
+    await db.snapshot_balances()
+
+    # Rebuild the in-memory state from what was just written
+    await db._load_company_cache()
+    await db._load_order_books()
+    await db._load_leaderboard()
+    return user_ids, names
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="profit_pulse_bench_")
+    db = DatabaseUser(os.path.join(workdir, "bench.db"))
+    await db.init_db()
+
+    stub = await start_pnw_stub(args.pnw_port)
+    pnw = PnWClient("bench", base_url=f"http://127.0.0.1:{args.pnw_port}/graphql")
+
+    # Point the command handlers at the synthetic database and the stub API
+    main.db = db
+    main.pnw = pnw
+    main.tx_log.get_channel = FakeChannel
+    main.tx_log.ledger_path = os.path.join(workdir, "transactions.jsonl")
+    main.tx_log.start()
+
+    started = time.perf_counter()
+    user_ids, names = await generate(db, args.users, args.companies, args.days, args.holdings, args.trades)
+    print(f"Generated {args.users} users, {args.companies} companies, {args.days} days of history "
+          f"in {time.perf_counter() - started:.1f}s ({workdir})")
+
+    rng = random.Random(7)
+
+    # Each operation returns its interaction, so error replies count as errors, not as latencies
+    async def buy():
+        interaction = FakeInteraction(int(rng.choice(user_ids)))
+        await main.buy_shares.callback(interaction, rng.choice(names), rng.randint(1, 20))
+        return interaction
+
+    async def sell():
+        # Sell something the user actually holds, so the sample measures the trade path
+        for _ in range(10):
+            user_id = rng.choice(user_ids)
+            held = db.leaderboard.holdings.get(user_id)
+            if held:
+                break
+        company_name, shares = rng.choice(list(held.items())) if held else (rng.choice(names), 1)
+        interaction = FakeInteraction(int(user_id))
+        await main.sell_shares.callback(interaction, company_name, rng.randint(1, min(shares, 20)))
+        return interaction
+
+    async def whois():
+        user_id = rng.choice(user_ids)
+        interaction = FakeInteraction(int(user_id))
+        await main.whois.callback(interaction, f"<@{user_id}>")
+        return interaction
+
+    async def list_companies():
+        interaction = FakeInteraction(int(rng.choice(user_ids)))
+        await main.list_companies.callback(interaction)
+        return interaction
+
+    async def graph():
+        interaction = FakeInteraction(int(rng.choice(user_ids)))
+        await main.share_price_graph.callback(interaction, rng.choice(names), rng.choice(PERIODS))
+        return interaction
+
+    async def tick():
+        await main.update_share_prices()
+
+    operations = {
+        "buy_shares": (buy, args.weight_buy),
+        "sell_shares": (sell, args.weight_sell),
+        "whois": (whois, args.weight_whois),
+        "list_companies": (list_companies, args.weight_list),
+        "share_price_graph": (graph, args.weight_graph),
+        "update_share_prices": (tick, args.weight_tick),
+    }
+    choices = [name for name, (_, weight) in operations.items() if weight > 0]
+    weights = [operations[name][1] for name in choices]
+    latencies = {name: [] for name in choices}
+    errors = {name: 0 for name in choices}
+    remaining = args.requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            name = rng.choices(choices, weights)[0]
+            start = time.perf_counter()
+            try:
+                interaction = await operations[name][0]()
+                failure = interaction.rejection if interaction else None
+            except Exception as e:
+                failure = repr(e)
+            elapsed = time.perf_counter() - start
+            if failure is None:
+                latencies[name].append(elapsed)
+            else:
+                errors[name] += 1
+                if errors[name] == 1:
+                    print(f"{name} failed: {failure}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    print(f"\n{args.requests} requests, concurrency {args.concurrency}, {elapsed:.2f}s, {args.requests / elapsed:.1f} req/s")
+    print(f"{'operation':<22}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name in choices:
+        samples = latencies[name]
+        if not samples:
+            if errors[name]:
+                print(f"{name:<22}{0:>7}{errors[name]:>8}")
+            continue
+        print(f"{name:<22}{len(samples):>7}{errors[name]:>8}"
+              f"{percentile(samples, 0.50) * 1000:>10.2f}{percentile(samples, 0.99) * 1000:>10.2f}{max(samples) * 1000:>10.2f}")
+    print(f"company cache: {db.cache_stats()}, chart cache hits/misses: {main.charts.hits}/{main.charts.misses}")
+
+    await main.tx_log.stop()
+    await pnw.close()
+    await stub.cleanup()
+    await db.close()
+    main.charts.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load-test DatabaseUser and the slash command handlers.")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--companies", type=int, default=100)
+    parser.add_argument("--days", type=float, default=2, help="Days of minute price history to generate")
+    parser.add_argument("--holdings", type=int, default=5, help="Companies held per user")
+    parser.add_argument("--trades", type=int, default=2000, help="Open market orders to generate")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--pnw-port", type=int, default=8765)
+    parser.add_argument("--weight-buy", type=float, default=30)
+    parser.add_argument("--weight-sell", type=float, default=20)
+    parser.add_argument("--weight-whois", type=float, default=20)
+    parser.add_argument("--weight-list", type=float, default=10)
+    parser.add_argument("--weight-graph", type=float, default=15)
+    parser.add_argument("--weight-tick", type=float, default=5)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
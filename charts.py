@@ -0,0 +1,100 @@
+import asyncio
+import collections
+import concurrent.futures
+import datetime
+import io
+import time
+from metrics import metrics
+import analytics
+
+UP_COLOR = 'green'
+DOWN_COLOR = 'red'
+
+
+def create_and_save_graph(company_name, timestamps, prices, period, overlay=None):
+    # The plotting stack is imported on the first render, not at startup
+    import numpy as np
+    import matplotlib.dates as mdates
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import LineCollection
+    from matplotlib.figure import Figure
+
+    # Object-oriented Agg API: each render owns its figure, so workers don't share pyplot state
+    fig = Figure(figsize=(10, 5))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    tz = datetime.datetime.now().astimezone().tzinfo  # Axis labels in local time, as before
+    x = mdates.date2num(np.asarray(timestamps, dtype='datetime64[s]'))
+    y = np.asarray(prices, dtype=float)
+
+    # Green where the price rose, red otherwise; one collection for the whole series
+    rising = y[1:] > y[:-1]
+    segment_colors = np.where(rising, UP_COLOR, DOWN_COLOR)
+    points = np.column_stack((x, y))
+    segments = np.stack((points[:-1], points[1:]), axis=1)
+    ax.add_collection(LineCollection(segments, colors=segment_colors, linewidths=2))
+    # Each point takes the colour of the segment ending at it
+    point_colors = np.concatenate((segment_colors[:1], segment_colors)) if len(segment_colors) else [UP_COLOR]
+    ax.scatter(x, y, c=point_colors, s=25, zorder=3)
+    ax.autoscale_view()
+
+    # Optional moving-average overlays ("sma", "ema" or "both")
+    if overlay:
+        for label, series in analytics.overlay_series(y, overlay).items():
+            ax.plot(x, series, linewidth=1.5, label=label, zorder=2)
+        ax.legend(loc='upper left')
+
+    # Format and style the graph
+    ax.set_title(f"Share Price History for {company_name} ({period})")
+    ax.set_xlabel('Time')
+    ax.set_ylabel('Share Price')
+    ax.grid(True)
+    ax.tick_params(axis='x', labelrotation=45)
+
+    # Adjust the x-axis to show only key time points, not cluttered data
+    if period in ['1h', '12h']:
+        ax.xaxis.set_major_locator(mdates.AutoDateLocator(tz=tz, maxticks=10))  # Adjust for shorter periods
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M', tz=tz))
+    else:
+        ax.xaxis.set_major_locator(mdates.AutoDateLocator(tz=tz, maxticks=6))  # Adjust for longer periods
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%m-%d %H:%M', tz=tz))
+
+    fig.tight_layout()  # Keep the rotated tick labels inside the image
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+
+class ChartEngine:
+    def __init__(self, workers: int = 2, cache_size: int = 256):
+        # Persistent render pool instead of a fresh executor per request
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chart")
+        self._cache = collections.OrderedDict()  # (company, period, snapshot_ts, overlay) -> PNG bytes
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+
+    def get_cached(self, company_name: str, period: str, snapshot_ts, overlay=None):
+        key = (company_name, period, snapshot_ts, overlay)
+        png = self._cache.get(key)
+        if png is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._cache.move_to_end(key)
+        return png
+
+    async def render(self, company_name: str, period: str, snapshot_ts, timestamps, prices, overlay=None):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        png = await loop.run_in_executor(self._pool, create_and_save_graph, company_name, timestamps, prices, period, overlay)
+        metrics.observe("chart_render_seconds", time.perf_counter() - start, period=period)
+
+        self._cache[(company_name, period, snapshot_ts, overlay)] = png
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)  # Least recently used
+        return png
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
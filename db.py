@@ -1,128 +1,440 @@
-import aiosqlite
 import datetime
+import itertools
+import time
+from pool import ConnectionPool
+from orderbook import ASK, BID, Order, OrderBook
+from metrics import metrics
+from leaderboard import Leaderboard
+from autocomplete import NameIndex
+from lanes import Lanes
+from alerts import ABOVE, BELOW, MAX_ALERTS_PER_USER, AlertBook
+import pricing
 
+# OHLC rollup granularities maintained by the price tick, in seconds
+ROLLUPS = {"5m": 300, "1h": 3600, "1d": 86400}
+
+# Periods served from the in-memory price rings: (seconds, keep every n-th minute).
+# 12h and 1d keep every fifth minute, matching the 5m rollup they'd otherwise read.
+RING_PERIODS = {"1h": (3600, 1), "12h": (43200, 5), "1d": (86400, 5)}
+
+# Stored in PRAGMA user_version; bump it whenever SCHEMA or MIGRATIONS change
+SCHEMA_VERSION = 4
+
+# (version, method) run in order against databases older than version, before SCHEMA
+MIGRATIONS = [
+    (1, "_migrate_unversioned"),
+]
+
+CREDITS = ""  # company_name of credit movements in the ledger and balance snapshots
+SNAPSHOTS_KEPT = 3  # Balance snapshots retained; replay starts from the newest
+
+ROLLUP_TABLES = "".join(f"""
+CREATE TABLE IF NOT EXISTS share_price_rollup_{name} (
+    company_name TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    open REAL NOT NULL,
+    high REAL NOT NULL,
+    low REAL NOT NULL,
+    close REAL NOT NULL,
+    PRIMARY KEY (company_name, bucket)
+) WITHOUT ROWID;
+""" for name in ROLLUPS)
+
+# The whole schema as one script and one transaction
+SCHEMA = f"""
+BEGIN IMMEDIATE;
+
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    nation_id TEXT NOT NULL,
+    credits INTEGER DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS companies (
+    company_name TEXT PRIMARY KEY,
+    share_price REAL NOT NULL,
+    user_id TEXT NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users (user_id)
+);
+
+CREATE TABLE IF NOT EXISTS total_shares (
+    company_name TEXT NOT NULL,
+    total_shares INTEGER NOT NULL,
+    PRIMARY KEY (company_name),
+    FOREIGN KEY (company_name) REFERENCES companies (company_name)
+);
+
+-- Share price history, keyed by epoch seconds
+CREATE TABLE IF NOT EXISTS share_price_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    company_name TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    share_price REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_share_price_history_company_ts
+ON share_price_history (company_name, ts);
+
+-- OHLC rollups of the price history, one table per granularity
+{ROLLUP_TABLES}
+CREATE TABLE IF NOT EXISTS user_shares (
+    user_id TEXT NOT NULL,
+    company_name TEXT NOT NULL,
+    shares INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, company_name),
+    FOREIGN KEY (user_id) REFERENCES users (user_id),
+    FOREIGN KEY (company_name) REFERENCES companies (company_name)
+);
+-- A company's holders, for dividends
+CREATE INDEX IF NOT EXISTS idx_user_shares_company
+ON user_shares (company_name, shares);
+
+CREATE TABLE IF NOT EXISTS registered_shares (
+    company_name TEXT NOT NULL,
+    registered_share INTEGER NOT NULL,
+    PRIMARY KEY (company_name),
+    FOREIGN KEY (company_name) REFERENCES companies (company_name)
+);
+
+-- Market orders; seller_id is the order owner, which is the buyer for bids
+CREATE TABLE IF NOT EXISTS trades (
+    trade_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    seller_id INTEGER NOT NULL,
+    company_name TEXT NOT NULL,
+    shares_available INTEGER NOT NULL,
+    price_per_share REAL NOT NULL,
+    to_user_id INTEGER,
+    side TEXT NOT NULL DEFAULT 'ask',
+    created_at INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_trades_book
+ON trades (company_name, side, price_per_share, trade_id);
+-- Keyset paging of /market without a company filter, or filtered by seller
+CREATE INDEX IF NOT EXISTS idx_trades_side_price
+ON trades (side, price_per_share, trade_id);
+CREATE INDEX IF NOT EXISTS idx_trades_seller
+ON trades (seller_id, side, price_per_share, trade_id);
+
+-- Append-only record of every credit and share movement; company_name '' is credits
+CREATE TABLE IF NOT EXISTS ledger (
+    entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    company_name TEXT NOT NULL,
+    delta REAL NOT NULL,
+    reason TEXT NOT NULL,
+    ref TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_ledger_user
+ON ledger (user_id, entry_id);
+
+-- Every balance as of ledger entry_id; replay adds the entries after it
+CREATE TABLE IF NOT EXISTS balance_snapshots (
+    snapshot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    entry_id INTEGER NOT NULL,
+    ts INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snapshot_balances (
+    snapshot_id INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    company_name TEXT NOT NULL,
+    balance REAL NOT NULL,
+    PRIMARY KEY (snapshot_id, user_id, company_name)
+) WITHOUT ROWID;
+
+-- One-shot price alerts; direction is fixed at creation from the price at the time
+CREATE TABLE IF NOT EXISTS alerts (
+    alert_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    company_name TEXT NOT NULL,
+    direction TEXT NOT NULL CHECK (direction IN ('above', 'below')),
+    threshold REAL NOT NULL,
+    created_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_alerts_user
+ON alerts (user_id, alert_id);
+
+-- Recurring dividends; each one is paid when next_run comes round, then moved on by its interval
+CREATE TABLE IF NOT EXISTS payouts (
+    payout_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    company_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    amount_per_share REAL NOT NULL,
+    interval_seconds INTEGER NOT NULL,
+    next_run INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_payouts_next_run
+ON payouts (next_run);
+
+-- Small key/value store for bot state, e.g. the synced command hash
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+PRAGMA user_version = {SCHEMA_VERSION};
+COMMIT;
+"""
+
+@metrics.instrument("db_query_seconds")  # Per-method timing and call counts
 class DatabaseUser:
-    def __init__(self, db_name='user.db'):
+    def __init__(self, db_name='user.db', readers: int = 4, record_changes_only: bool = False, keyframe_interval: int = 3600):
         self.db_name = db_name  # Initialize the database path
+        self.pool = ConnectionPool(db_name, readers=readers)  # Long-lived writer + reader connections
+        # Change-only recording: a history row is written when the price moves, plus a keyframe
+        # every keyframe_interval seconds; reads forward-fill the minutes in between
+        self.record_changes_only = record_changes_only
+        self.keyframe_interval = keyframe_interval
+        self.last_recorded = None  # company_name -> (ts, share_price) of its newest history row
+        # Write-through company cache: company_name -> [share_price, total_shares, registered_shares, owner_id]
+        self.companies = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.last_snapshot_ts = None  # Timestamp of the most recent price tick written
+        self.price_rings = None  # Last day of ticks per company, once warm_price_rings has run
+        self.pending_ticks = None  # Ticks stored while warm_price_rings is reading, replayed at hand-over
+        self.order_books = {}  # company_name -> OrderBook of public (non-direct) orders
+        self.lanes = Lanes()  # Per-company execution lanes; every trade and repricing runs in its company's lane
+        self.leaderboard = Leaderboard()  # Net-worth ranking, updated by every mutator below
+        self.company_index = NameIndex()  # Company names for autocomplete, kept in step with the cache
+        self.alert_book = AlertBook()  # Open price alerts, checked against every price move
+        self.on_alerts = None  # Called with the alerts a price move fired; they're already out of alert_book
 
     async def init_db(self):
-        async with aiosqlite.connect(self.db_name) as db:
-            # Users table
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id TEXT PRIMARY KEY,
-                    nation_id TEXT NOT NULL,
-                    credits INTEGER DEFAULT 0
-                )
-            ''')
-            await db.commit()
-            print("Users table created successfully")
-
-            # Companies table without total_shares
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS companies (
-                    company_name TEXT PRIMARY KEY,
-                    share_price REAL NOT NULL,
-                    user_id TEXT NOT NULL,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            ''')
-            await db.commit()
-            print("Companies table created successfully")
-
-            # Total Shares table
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS total_shares (
-                    company_name TEXT NOT NULL,
-                    total_shares INTEGER NOT NULL,
-                    PRIMARY KEY (company_name),
-                    FOREIGN KEY (company_name) REFERENCES companies (company_name)
-                )
-            ''')
-            await db.commit()
-            print("Total Shares table created successfully")
-
-            # Share price history table
-            await db.execute('''    
-                CREATE TABLE IF NOT EXISTS share_price_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    company_name TEXT NOT NULL,
-                    date TEXT NOT NULL,
-                    time TEXT NOT NULL,
-                    share_price REAL NOT NULL
-                )
-            ''')
-            await db.commit()
-            print("Share price history table created successfully")
-
-            # User shares table
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS user_shares (
-                    user_id TEXT NOT NULL,
-                    company_name TEXT NOT NULL,
-                    shares INTEGER NOT NULL DEFAULT 0,
-                    PRIMARY KEY (user_id, company_name),
-                    FOREIGN KEY (user_id) REFERENCES users (user_id),
-                    FOREIGN KEY (company_name) REFERENCES companies (company_name)
-                )
-            ''')
-            await db.commit()
-            print("User shares table created successfully")
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS registered_shares (
-                    company_name TEXT NOT NULL,
-                    registered_share INTEGER NOT NULL,
-                    PRIMARY KEY (company_name),
-                    FOREIGN KEY (company_name) REFERENCES companies (company_name)
+        if self.pool.is_open:
+            return  # on_ready fires again on reconnect; the pool is already up
+        await self.pool.open()
+
+        # An up-to-date database costs one pragma read; only older ones run the bootstrap
+        async with self.pool.reader() as db:
+            async with db.execute("PRAGMA user_version") as cursor:
+                version = (await cursor.fetchone())[0]
+        if version < SCHEMA_VERSION:
+            await self._upgrade_schema(version)
+
+        await self._load_company_cache()
+        await self._load_order_books()
+        await self._load_leaderboard()
+        await self._load_alerts()
+        last_tick = await self.get_meta("last_tick_ts")
+        self.last_snapshot_ts = int(last_tick) if last_tick else None
+
+    async def _upgrade_schema(self, version: int):
+        # Migrations reshape existing tables first, then the schema script creates whatever
+        # is missing and stamps the new version, all in a single executescript
+        for target, migration in MIGRATIONS:
+            if version < target:
+                async with self.pool.writer() as db:
+                    await getattr(self, migration)(db)
+        await self.pool.executescript(SCHEMA)
+
+        async with self.pool.writer() as db:
+            for name in ROLLUPS:
+                await self._backfill_rollup(db, name)
+        if version < 2:
+            # Balances from before the ledger existed become its opening snapshot
+            await self.snapshot_balances()
+        print(f"Database schema upgraded from version {version} to {SCHEMA_VERSION}")
+
+    async def _migrate_unversioned(self, db):
+        # Databases from before the schema was versioned, brought up to date table by table
+        await self._migrate_share_price_history(db)
+        await self._dedupe_share_price_history(db)
+        await self._migrate_trades(db)
+
+    async def _table_columns(self, db, table: str):
+        async with db.execute(f"PRAGMA table_info({table})") as cursor:
+            return [row[1] for row in await cursor.fetchall()]
+
+    async def _migrate_share_price_history(self, db):
+        # Older databases stored local date/time strings; rebuild them with epoch timestamps
+        columns = await self._table_columns(db, "share_price_history")
+        if not columns or "ts" in columns:
+            return
+
+        await db.execute('''
+            CREATE TABLE share_price_history_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                company_name TEXT NOT NULL,
+                ts INTEGER NOT NULL,
+                share_price REAL NOT NULL
+            )
+        ''')
+        # The strings were written with datetime.now(), so convert from local time
+        await db.execute('''
+            INSERT INTO share_price_history_new (id, company_name, ts, share_price)
+            SELECT id, company_name, CAST(strftime('%s', date || ' ' || time, 'utc') AS INTEGER), share_price
+            FROM share_price_history
+        ''')
+        await db.execute("DROP TABLE share_price_history")
+        await db.execute("ALTER TABLE share_price_history_new RENAME TO share_price_history")
+        print("Share price history migrated to epoch timestamps")
+
+    async def _dedupe_share_price_history(self, db):
+        # One snapshot per company per timestamp is enforced by a unique index;
+        # databases created before it existed may hold duplicates
+        if not await self._table_columns(db, "share_price_history"):
+            return
+        async with db.execute("""
+            SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'uq_share_price_history_company_ts'
+        """) as cursor:
+            if await cursor.fetchone():
+                return
+
+        await db.execute("DROP INDEX IF EXISTS idx_share_price_history_company_ts")
+        await db.execute("""
+            DELETE FROM share_price_history
+            WHERE id NOT IN (SELECT MIN(id) FROM share_price_history GROUP BY company_name, ts)
+        """)
+
+    async def _backfill_rollup(self, db, name: str):
+        # Seed an empty rollup table from whatever raw history is still around
+        async with db.execute(f"SELECT 1 FROM share_price_rollup_{name} LIMIT 1") as cursor:
+            if await cursor.fetchone():
+                return
+
+        size = ROLLUPS[name]
+        await db.execute(f"""
+            INSERT OR IGNORE INTO share_price_rollup_{name} (company_name, bucket, open, high, low, close)
+            SELECT company_name, bucket, open, high, low, close FROM (
+                SELECT company_name, ts / {size} * {size} AS bucket,
+                    FIRST_VALUE(share_price) OVER w AS open,
+                    MAX(share_price) OVER w AS high,
+                    MIN(share_price) OVER w AS low,
+                    LAST_VALUE(share_price) OVER w AS close,
+                    ROW_NUMBER() OVER w AS rn
+                FROM share_price_history
+                WINDOW w AS (
+                    PARTITION BY company_name, ts / {size} ORDER BY ts
+                    ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
                 )
-            ''')
-            await db.commit()
-            print("Registered Shares table created successfully")
-        
-            await db.execute('''
-            CREATE TABLE IF NOT EXISTS trades (
-            trade_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            seller_id INTEGER NOT NULL,
-            company_name TEXT NOT NULL,
-            shares_available INTEGER NOT NULL,
-            price_per_share REAL NOT NULL,
-            to_user_id INTEGER
             )
-            ''')
-            await db.commit()
-            print("Trades table created successfully")
+            WHERE rn = 1
+        """)
+
+    async def _migrate_trades(self, db):
+        # Listings from before the order book are all asks
+        columns = await self._table_columns(db, "trades")
+        if not columns:
+            return
+        if "side" not in columns:
+            await db.execute("ALTER TABLE trades ADD COLUMN side TEXT NOT NULL DEFAULT 'ask'")
+        if "created_at" not in columns:
+            await db.execute("ALTER TABLE trades ADD COLUMN created_at INTEGER")
+
+    async def _load_order_books(self):
+        self.order_books = {}
+        async with self.pool.reader() as db:
+            async with db.execute("""
+                SELECT trade_id, seller_id, company_name, side, price_per_share, shares_available
+                FROM trades
+                WHERE to_user_id IS NULL
+                ORDER BY trade_id
+            """) as cursor:
+                rows = await cursor.fetchall()
+        for row in rows:
+            self.get_order_book(row[2]).add(Order(*row))
+
+    async def _load_leaderboard(self):
+        # The only full scan; after this every change is applied incrementally
+        async with self.pool.reader() as db:
+            async with db.execute("SELECT user_id, credits FROM users") as cursor:
+                users = await cursor.fetchall()
+            async with db.execute("SELECT user_id, company_name, shares FROM user_shares WHERE shares > 0") as cursor:
+                holdings = await cursor.fetchall()
+            async with db.execute("SELECT company_name, share_price FROM companies") as cursor:
+                prices = await cursor.fetchall()
+        self.leaderboard.load(users, holdings, prices)
+
+    async def _load_alerts(self):
+        async with self.pool.reader() as db:
+            async with db.execute("SELECT alert_id, user_id, company_name, direction, threshold FROM alerts") as cursor:
+                self.alert_book.load(await cursor.fetchall())
+
+    def get_order_book(self, company_name: str):
+        book = self.order_books.get(company_name)
+        if book is None:
+            book = self.order_books[company_name] = OrderBook(company_name)
+        return book
+
+    async def _load_company_cache(self):
+        async with self.pool.reader() as db:
+            async with db.execute("""
+                SELECT c.company_name, c.share_price, ts.total_shares, rs.registered_share, c.user_id
+                FROM companies c
+                LEFT JOIN total_shares ts ON c.company_name = ts.company_name
+                LEFT JOIN registered_shares rs ON c.company_name = rs.company_name
+            """) as cursor:
+                rows = await cursor.fetchall()
+        self.companies = {row[0]: list(row[1:]) for row in rows}
+        self.company_index = NameIndex(self.companies)
+
+    def _check_company(self, company_name: str):
+        # Lanes and their metric series are keyed by company name, so user-typed names are
+        # checked against the cache before a lane is taken; otherwise every typo would leave one behind
+        if self.companies is not None and company_name not in self.companies:
+            raise ValueError("Invalid company name.")
+
+    def _cached_company(self, company_name: str):
+        cached = self.companies.get(company_name) if self.companies is not None else None
+        if cached:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+        return cached
+
+    def cache_stats(self):
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "companies": len(self.companies or ())
+        }
+
+    async def close(self):
+        await self.pool.close()
+
+    async def get_meta(self, key: str):
+        async with self.pool.reader() as db:
+            async with db.execute("SELECT value FROM meta WHERE key = ?", (key,)) as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result else None
+
+    async def set_meta(self, key: str, value: str):
+        async with self.pool.writer() as db:
+            await db.execute("""
+                INSERT INTO meta (key, value) VALUES (?, ?)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value
+            """, (key, value))
 
     async def add_user(self, user_id: str, nation_id: str):
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self.pool.writer() as db:
+            previous = await self._fetch_credits(db, user_id)
             await db.execute(
                 "INSERT OR REPLACE INTO users (user_id, nation_id) VALUES (?, ?)",
                 (user_id, nation_id)
             )
-            await db.commit()
+            await self._record(db, [(user_id, CREDITS, -previous)], "register")
+        # REPLACE starts the row over with the default credits
+        self.leaderboard.set_user(user_id, 0)
 
     async def get_user_data_by_user_id(self, user_id: str):
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self.pool.reader() as db:
             async with db.execute("SELECT nation_id FROM users WHERE user_id = ?", (user_id,)) as cursor:
                 result = await cursor.fetchone()
                 return result[0] if result else None
 
     async def get_user_data_by_nation_id(self, nation_id: str):
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self.pool.reader() as db:
             async with db.execute("SELECT user_id FROM users WHERE nation_id = ?", (nation_id,)) as cursor:
                 result = await cursor.fetchone()
                 return result[0] if result else None
 
     async def add_credits(self, user_id: str, amount: int):
-        async with aiosqlite.connect(self.db_name) as db:
-            await db.execute("""
-                UPDATE users
-                SET credits = credits + ?
-                WHERE user_id = ?
-            """, (amount, user_id))
-            await db.commit()
+        async with self.pool.writer() as db:
+            await self._move_credits(db, user_id, amount, "add_credits")
+        self.leaderboard.add_credits(user_id, amount)
 
     async def get_user_credits(self, user_id: str):
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self.pool.reader() as db:
             async with db.execute("""
                 SELECT credits FROM users WHERE user_id = ?
             """, (user_id,)) as cursor:
@@ -130,21 +442,32 @@ class DatabaseUser:
                 return result[0] if result else None
 
     async def add_company(self, company_name: str, share_price: float, total_shares: int, user_id: str):
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self.pool.writer() as db:
             await db.execute(
                 "INSERT INTO companies (company_name, share_price, user_id) VALUES (?, ?, ?)",
                 (company_name, share_price, user_id)
             )
-            await db.commit()
 
             await db.execute(
                 "INSERT INTO total_shares (company_name, total_shares) VALUES (?, ?)",
                 (company_name, total_shares)
             )
-            await db.commit()
+
+        if self.companies is not None:
+            # user_id is stored in a TEXT column, so cache it the way it reads back
+            self.companies[company_name] = [share_price, total_shares, None, str(user_id)]
+        self.company_index.add(company_name)
+        self.leaderboard.set_price(company_name, share_price)
 
     async def get_company_by_name(self, company_name: str):
-        async with aiosqlite.connect(self.db_name) as db:
+        cached = self._cached_company(company_name)
+        if cached:
+            share_price, total_shares, _, user_id = cached
+            return (company_name, share_price, total_shares, user_id)
+        if self.companies is not None:
+            return None  # The loaded cache holds every company; a miss is an unknown name
+
+        async with self.pool.reader() as db:
             async with db.execute("""
                 SELECT c.company_name, c.share_price, ts.total_shares, c.user_id
                 FROM companies c
@@ -155,7 +478,7 @@ class DatabaseUser:
                 return result  # This will be a tuple (company_name, share_price, total_shares, user_id)
 
     async def get_company_data_by_user_id(self, user_id: str):
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self.pool.reader() as db:
             async with db.execute("""
                 SELECT c.company_name, c.share_price, ts.total_shares
                 FROM companies c
@@ -166,13 +489,18 @@ class DatabaseUser:
                 return result
 
     async def get_company_price(self, share_price: str):
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self.pool.reader() as db:
             async with db.execute("SELECT share_price FROM companies WHERE share_price = ?", (share_price,)) as cursor:
                 result = await cursor.fetchone()
                 return result[0] if result else None
 
     async def get_all_companies(self):
-        async with aiosqlite.connect(self.db_name) as db:
+        if self.companies is not None:
+            self.cache_hits += 1
+            return [(name, share_price, total_shares, user_id) for name, (share_price, total_shares, _, user_id) in self.companies.items()]
+        self.cache_misses += 1
+
+        async with self.pool.reader() as db:
             async with db.execute("""
                 SELECT c.company_name, c.share_price, ts.total_shares, c.user_id
                 FROM companies c
@@ -182,69 +510,217 @@ class DatabaseUser:
                 return result
 
     async def update_user_credits_after_purchase(self, user_id: str, amount: int):
-        async with aiosqlite.connect(self.db_name) as db:
-            await db.execute("""
-                UPDATE users
-                SET credits = credits - ?
-                WHERE user_id = ?
-            """, (amount, user_id))
-            await db.commit()
+        async with self.pool.writer() as db:
+            await self._move_credits(db, user_id, -amount, "purchase")
+        self.leaderboard.add_credits(user_id, -amount)
 
     async def update_company_share_price(self, company_name: str, new_share_price: float):
-        async with aiosqlite.connect(self.db_name) as db:
+        self._check_company(company_name)
+        async with self.lanes.lane(company_name):
+            async with self.pool.writer() as db:
+                await db.execute("""
+                    UPDATE companies
+                    SET share_price = ?
+                    WHERE company_name = ?
+                """, (new_share_price, company_name))
+            self._update_cached_company(company_name, share_price=new_share_price)
+            self.leaderboard.set_price(company_name, new_share_price)
+
+    async def store_share_price_history(self, company_name: str, ts: int, share_price: float):
+        await self.store_share_price_snapshot(ts, [(company_name, share_price)])
+
+    async def store_share_price_snapshot(self, ts: int, prices):
+        # prices is an iterable of (company_name, share_price); the whole tick commits at once
+        # and the unique (company_name, ts) index drops repeats of an already-stored tick
+        rows = [(company_name, ts, share_price) for company_name, share_price in prices]
+        if not rows:
+            return
+        recorded = rows
+        if self.record_changes_only:
+            if self.last_recorded is None:
+                await self._load_last_recorded()
+            recorded = [row for row in rows if self._needs_history_row(*row)]
+        metrics.inc("history_rows_written_total", len(recorded))
+        metrics.inc("history_rows_skipped_total", len(rows) - len(recorded))
+
+        async with self.pool.writer() as db:
+            await db.executemany("""
+                INSERT OR IGNORE INTO share_price_history (company_name, ts, share_price)
+                VALUES (?, ?, ?)
+            """, recorded)
+
+            # Fold the tick into each rollup's current bucket
+            for name, size in ROLLUPS.items():
+                bucket = ts // size * size
+                await db.executemany(f"""
+                    INSERT INTO share_price_rollup_{name} (company_name, bucket, open, high, low, close)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(company_name, bucket) DO UPDATE SET
+                        high = MAX(high, excluded.high),
+                        low = MIN(low, excluded.low),
+                        close = excluded.close
+                """, [(company_name, bucket, price, price, price, price) for company_name, _, price in rows])
+
+            # Change-only history can't tell when the last tick ran, so it's kept here
             await db.execute("""
-                UPDATE companies
-                SET share_price = ?
-                WHERE company_name = ?
-            """, (new_share_price, company_name))
-            await db.commit()
-    async def store_share_price_history(self, company_name: str, date: str, time: str, share_price: float):
-        async with aiosqlite.connect(self.db_name) as db:
-            # First check if the record already exists
+                INSERT INTO meta (key, value) VALUES ('last_tick_ts', ?)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value
+            """, (str(ts),))
+
+        if self.last_recorded is not None:
+            for company_name, _, price in recorded:
+                self.last_recorded[company_name] = (ts, price)
+        # Rollups and rings still see every tick; only the raw rows are thinned out
+        if self.price_rings is not None:
+            self.price_rings.append(ts, [(company_name, price) for company_name, _, price in rows])
+        elif self.pending_ticks is not None:
+            self.pending_ticks.append((ts, [(company_name, price) for company_name, _, price in rows]))
+        self.last_snapshot_ts = ts
+        self._check_alerts([(company_name, price) for company_name, _, price in rows])
+
+    async def _load_last_recorded(self):
+        async with self.pool.reader() as db:
             async with db.execute("""
-                SELECT * FROM share_price_history WHERE company_name = ? AND date = ? AND time = ?
-            """, (company_name, date, time)) as cursor:
-                result = await cursor.fetchone()
-        
-            if result is None:  # If no record exists, insert the new one
-                await db.execute("""
-                    INSERT INTO share_price_history (company_name, date, time, share_price)
-                    VALUES (?, ?, ?, ?)
-                """, (company_name, date, time, share_price))
-                await db.commit()
+                SELECT company_name, MAX(ts), share_price FROM share_price_history GROUP BY company_name
+            """) as cursor:
+                rows = await cursor.fetchall()
+        self.last_recorded = {company_name: (ts, price) for company_name, ts, price in rows}
+
+    def _needs_history_row(self, company_name: str, ts: int, share_price: float):
+        last = self.last_recorded.get(company_name)
+        return last is None or last[1] != share_price or ts - last[0] >= self.keyframe_interval
+
+    async def warm_price_rings(self):
+        # Loads the last day of ticks into memory. Startup runs this in the background; reads
+        # fall back to SQLite until it's done. The read runs on a reader so trades and ticks
+        # aren't held up; ticks stored meanwhile are buffered and replayed at the hand-over.
+        from ringbuffer import PriceRings, RING_MINUTES, fill_steps
+        horizon = int(time.time()) - RING_MINUTES * 60
+        self.pending_ticks = []
+        # Every tick up to here has committed, so the read below is sure to include it
+        end_ts = self.last_snapshot_ts
+        try:
+            async with self.pool.reader() as db:
+                # One keyframe interval further back finds the price in force at the horizon
+                async with db.execute("""
+                    SELECT company_name, ts, share_price FROM share_price_history
+                    WHERE ts >= ?
+                    ORDER BY company_name, ts
+                """, (horizon - self.keyframe_interval,)) as cursor:
+                    rows = await cursor.fetchall()
+            rings = PriceRings(horizon)
+            end_ts = end_ts or max((row[1] for row in rows), default=horizon)
+            for company_name, group in itertools.groupby(rows, key=lambda row: row[0]):
+                _, timestamps, prices = zip(*group)
+                rings.load(company_name, *fill_steps(timestamps, prices, horizon, end_ts, self.keyframe_interval))
+            # No await from here on: nothing can land between the catch-up and the hand-over.
+            # Ticks the read already covered are ignored by the rings.
+            for ts, prices in self.pending_ticks:
+                rings.append(ts, prices)
+            self.price_rings = rings
+        finally:
+            self.pending_ticks = None
+
+    async def get_price_series(self, company_name: str, period: str):
+        # (timestamps, prices) for charts and analytics. Short periods are zero-copy views of the
+        # price ring; anything the ring can't cover reads get_share_price_history as before.
+        window = RING_PERIODS.get(period)
+        if window and self.price_rings is not None:
+            seconds, step = window
+            start_ts = int(time.time()) - seconds
+            if self.price_rings.covers(company_name, start_ts):
+                timestamps, prices = self.price_rings.since(company_name, start_ts, step)
+                if len(timestamps):
+                    return timestamps, prices
+
+        rows = await self.get_share_price_history(company_name, period)
+        if not rows:
+            return None
+        timestamps, prices = zip(*rows)
+        return timestamps, prices
+
+    async def compact_share_price_history(self, max_age: datetime.timedelta):
+        # Raw minute rows older than max_age are dropped; the rollups keep their OHLC summary
+        cutoff = int((datetime.datetime.now() - max_age).timestamp())
+        async with self.pool.writer() as db:
+            async with db.execute("SELECT DISTINCT company_name FROM share_price_history") as cursor:
+                companies = await cursor.fetchall()
+            # Per-company deletes stay on the (company_name, ts) index
+            await db.executemany(
+                "DELETE FROM share_price_history WHERE company_name = ? AND ts < ?",
+                [(company_name, cutoff) for company_name, in companies]
+            )
 
     async def get_share_price_history(self, company_name: str, period: str):
         today = datetime.datetime.now()
+        # Longer periods read a rollup level instead of every raw minute row
         if period == "1h":
             start_time = today - datetime.timedelta(hours=1)
             interval = datetime.timedelta(minutes=5)
+            rollup = None
         elif period == "12h":
             start_time = today - datetime.timedelta(hours=12)
             interval = datetime.timedelta(minutes=60)
+            rollup = "5m"
         elif period == "1d":
             start_time = today - datetime.timedelta(days=1)
             interval = datetime.timedelta(minutes=120)
+            rollup = "5m"
         elif period == "3d":
             start_time = today - datetime.timedelta(days=3)
             interval = datetime.timedelta(minutes=720)
+            rollup = "1h"
         elif period == "7d":
             start_time = today - datetime.timedelta(days=7)
             interval = datetime.timedelta(minutes=1440)
+            rollup = "1h"
         else:
             return None
 
-        start_time = start_time.strftime("%Y-%m-%d %H:%M:%S")
-    
-        async with aiosqlite.connect(self.db_name) as db:
+        start_ts = int(start_time.timestamp())
+
+        if rollup:
+            return await self.get_share_price_rollup(company_name, rollup, start_ts)
+
+        # Range scan over the (company_name, ts) index, starting at the row in force at start_ts
+        async with self.pool.reader() as db:
+            async with db.execute("""
+                SELECT ts, share_price FROM share_price_history
+                WHERE company_name = ? AND ts >= (
+                    SELECT COALESCE(MAX(ts), ?) FROM share_price_history WHERE company_name = ? AND ts <= ?
+                )
+                ORDER BY ts
+            """, (company_name, start_ts, company_name, start_ts)) as cursor:
+                result = await cursor.fetchall()
+        if not result:
+            return result
+
+        # Change-only rows are expanded back into one point per minute
+        from ringbuffer import fill_steps
+        end_ts = max(self.last_snapshot_ts or 0, result[-1][0])
+        timestamps, prices = zip(*result)
+        timestamps, prices = fill_steps(timestamps, prices, start_ts, end_ts, self.keyframe_interval)
+        return list(zip(timestamps.tolist(), prices.tolist()))
+
+    async def get_share_price_rollup(self, company_name: str, rollup: str, start_ts: int, ohlc: bool = False):
+        # Closing prices by default, so rollups plot like the raw (ts, share_price) rows
+        columns = "bucket, open, high, low, close" if ohlc else "bucket, close"
+        async with self.pool.reader() as db:
             async with db.execute(
-                "SELECT date, time, share_price FROM share_price_history WHERE company_name = ? AND datetime(date || ' ' || time) >= ? ORDER BY date, time",
-                (company_name, start_time)
+                f"SELECT {columns} FROM share_price_rollup_{rollup} WHERE company_name = ? AND bucket >= ? ORDER BY bucket",
+                (company_name, start_ts - start_ts % ROLLUPS[rollup])
             ) as cursor:
                 result = await cursor.fetchall()
                 return result
 
     async def get_company_name(self, company_name: str):
-        async with aiosqlite.connect(self.db_name) as db:
+        cached = self._cached_company(company_name)
+        if cached:
+            return cached[0]
+        if self.companies is not None:
+            return None
+
+        async with self.pool.reader() as db:
             async with db.execute("SELECT share_price FROM companies WHERE company_name = ?", (company_name,)) as cursor:
                 result = await cursor.fetchone()
                 if result:
@@ -252,16 +728,34 @@ class DatabaseUser:
                 return None
 
     async def get_user_shares(self, user_id: str, company_name: str) -> int:
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self.pool.reader() as db:
             async with db.execute("""
                 SELECT shares FROM user_shares WHERE user_id = ? AND company_name = ?
             """, (user_id, company_name)) as cursor:
                 result = await cursor.fetchone()
                 return result[0] if result else 0
 
+    async def get_portfolio(self, user_id: str):
+        # Holdings joined with the live price, worth computed in SQL: one query however many companies exist
+        async with self.pool.reader() as db:
+            async with db.execute("""
+                SELECT us.company_name, us.shares, c.share_price, us.shares * c.share_price AS worth
+                FROM user_shares us
+                JOIN companies c ON c.company_name = us.company_name
+                WHERE us.user_id = ? AND us.shares > 0
+                ORDER BY worth DESC
+            """, (user_id,)) as cursor:
+                result = await cursor.fetchall()
+                return result  # List of (company_name, shares, share_price, worth)
+
     async def update_user_shares(self, user_id: str, company_name: str, shares_change: int):
-        async with aiosqlite.connect(self.db_name) as db:
-            current_shares = await self.get_user_shares(user_id, company_name)
+        async with self.pool.writer() as db:
+            # Read on the writer connection so the check and the write share one transaction
+            async with db.execute("""
+                SELECT shares FROM user_shares WHERE user_id = ? AND company_name = ?
+            """, (user_id, company_name)) as cursor:
+                result = await cursor.fetchone()
+            current_shares = result[0] if result else 0
             new_shares = current_shares + shares_change
 
             if new_shares < 0:
@@ -272,87 +766,307 @@ class DatabaseUser:
                 VALUES (?, ?, ?)
                 ON CONFLICT(user_id, company_name) DO UPDATE SET shares=excluded.shares
             """, (user_id, company_name, new_shares))
-            await db.commit()
+            await self._record(db, [(user_id, company_name, shares_change)], "adjust")
+        self.leaderboard.set_shares(user_id, company_name, new_shares)
+
+    async def execute_trade(self, user_id: str, company_name: str, num_shares: int, side: str):
+        if num_shares <= 0:
+            raise ValueError("Number of shares must be positive.")
+        self._check_company(company_name)
+
+        async with self.lanes.lane(company_name):
+            # Balance check, share/credit movements and repricing all commit together
+            async with self.pool.writer() as db:
+                async with db.execute("""
+                    SELECT c.share_price, ts.total_shares, c.user_id
+                    FROM companies c
+                    LEFT JOIN total_shares ts ON c.company_name = ts.company_name
+                    WHERE c.company_name = ?
+                """, (company_name,)) as cursor:
+                    company = await cursor.fetchone()
+                if not company:
+                    raise ValueError("Invalid company name.")
+
+                share_price, total_shares, company_owner_id = company
+                if side not in ("buy", "sell"):
+                    raise ValueError(f"Unknown trade side: {side}")
+                if side == "buy" and total_shares < num_shares:
+                    raise ValueError(f"Not enough shares available. Available Shares: {total_shares}")
+
+                # Large orders are priced slice by slice, so one transaction replaces many small trades
+                quote = pricing.quote(share_price, total_shares, num_shares, side)
+                share_price, total = quote["share_price"], quote["total"]
+                new_price, new_shares = quote["new_price"], quote["new_shares"]
+
+                if side == "buy":
+                    async with db.execute("SELECT credits FROM users WHERE user_id = ?", (user_id,)) as cursor:
+                        result = await cursor.fetchone()
+                    if not result or result[0] < total:
+                        raise ValueError("You don't have enough coins to buy these shares.")
+
+                    shares_change, buyer_id, seller_id = num_shares, user_id, company_owner_id
+                else:
+                    async with db.execute("""
+                        SELECT shares FROM user_shares WHERE user_id = ? AND company_name = ?
+                    """, (user_id, company_name)) as cursor:
+                        result = await cursor.fetchone()
+                    if not result or result[0] < num_shares:
+                        raise ValueError("You don't have enough shares to sell.")
+
+                    shares_change, buyer_id, seller_id = -num_shares, company_owner_id, user_id
+
+                await self._move_shares(db, user_id, company_name, shares_change, side)
+
+                # Credits move from the buyer to the seller (the owner is the counterparty)
+                await self._move_credits(db, buyer_id, -total, side)
+                await self._move_credits(db, seller_id, total, side)
+
+                await db.execute("UPDATE companies SET share_price = ? WHERE company_name = ?", (new_price, company_name))
+                await db.execute("UPDATE total_shares SET total_shares = ? WHERE company_name = ?", (new_shares, company_name))
+
+            self._update_cached_company(company_name, share_price=new_price, total_shares=new_shares)
+            self.leaderboard.add_shares(user_id, company_name, shares_change)
+            self.leaderboard.add_credits(buyer_id, -total)
+            self.leaderboard.add_credits(seller_id, total)
+            self.leaderboard.set_price(company_name, new_price)
+
+        return {
+            "company_name": company_name,
+            "share_price": share_price,
+            "total": total,
+            "average_price": quote["average_price"],
+            "new_price": new_price,
+            "new_shares": new_shares,
+            "owner_id": company_owner_id
+        }
 
     async def remove_company(self, company_name: str):
-        async with aiosqlite.connect(self.db_name) as db:
-            # Remove from user_shares table first to prevent foreign key constraint issues
-            await db.execute("DELETE FROM user_shares WHERE company_name = ?", (company_name,))
-            await db.commit()
-        
-            # Remove from share_price_history table
-            await db.execute("DELETE FROM share_price_history WHERE company_name = ?", (company_name,))
-            await db.commit()
-
-            # Finally, remove from companies table
-            await db.execute("DELETE FROM companies WHERE company_name = ?", (company_name,))
-            await db.commit()
-
-            # Remove from total_shares table
-            await db.execute("DELETE FROM total_shares WHERE company_name = ?", (company_name,))
-            await db.commit()
+        # Runs in the company's lane so no trade is mid-flight while it goes
+        async with self.lanes.lane(company_name):
+            async with self.pool.writer() as db:
+                # Holders' shares go with the company; the ledger records each one in bulk
+                await db.execute("""
+                    INSERT INTO ledger (ts, user_id, company_name, delta, reason)
+                    SELECT ?, user_id, company_name, -shares, 'company_removed'
+                    FROM user_shares
+                    WHERE company_name = ? AND shares != 0
+                """, (int(time.time()), company_name))
+
+                # Remove from user_shares table first to prevent foreign key constraint issues
+                await db.execute("DELETE FROM user_shares WHERE company_name = ?", (company_name,))
+
+                # Remove from share_price_history table and its rollups
+                await db.execute("DELETE FROM share_price_history WHERE company_name = ?", (company_name,))
+                for name in ROLLUPS:
+                    await db.execute(f"DELETE FROM share_price_rollup_{name} WHERE company_name = ?", (company_name,))
+
+                # Finally, remove from companies table
+                await db.execute("DELETE FROM companies WHERE company_name = ?", (company_name,))
+
+                # Remove from total_shares table
+                await db.execute("DELETE FROM total_shares WHERE company_name = ?", (company_name,))
+
+                # Open market orders and price alerts go with it
+                await db.execute("DELETE FROM trades WHERE company_name = ?", (company_name,))
+                await db.execute("DELETE FROM alerts WHERE company_name = ?", (company_name,))
+                await db.execute("DELETE FROM payouts WHERE company_name = ?", (company_name,))
+
+            self.order_books.pop(company_name, None)
+
+            if self.companies is not None:
+                self.companies.pop(company_name, None)
+            self.company_index.remove(company_name)
+            self.leaderboard.remove_company(company_name)
+            self.alert_book.remove_company(company_name)
+
+        self.lanes.discard(company_name)
+        if self.price_rings is not None:
+            self.price_rings.discard(company_name)
+        if self.last_recorded is not None:
+            self.last_recorded.pop(company_name, None)
 
         print(f"Company {company_name} has been removed from the database.")
-        
+
     async def update_company_details(self, company_name: str, new_share_price: float, new_total_shares: int):
-        async with aiosqlite.connect(self.db_name) as db:
-            await db.execute("""
-                UPDATE companies
-                SET share_price = ?
-                WHERE company_name = ?
-            """, (new_share_price, company_name))
-            await db.commit()
+        self._check_company(company_name)
+        async with self.lanes.lane(company_name):
+            async with self.pool.writer() as db:
+                await db.execute("""
+                    UPDATE companies
+                    SET share_price = ?
+                    WHERE company_name = ?
+                """, (new_share_price, company_name))
+
+                await db.execute("""
+                    UPDATE total_shares
+                    SET total_shares = ?
+                    WHERE company_name = ?
+                """, (new_total_shares, company_name))
+            self._update_cached_company(company_name, share_price=new_share_price, total_shares=new_total_shares)
+            self.leaderboard.set_price(company_name, new_share_price)
+
+    def _update_cached_company(self, company_name: str, share_price=None, total_shares=None, registered_shares=None):
+        # Called after the write has committed, so the cache never runs ahead of the database
+        if share_price is not None:
+            self._check_alerts([(company_name, share_price)])
+        cached = self.companies.get(company_name) if self.companies is not None else None
+        if not cached:
+            return
+        if share_price is not None:
+            cached[0] = share_price
+        if total_shares is not None:
+            cached[1] = total_shares
+        if registered_shares is not None:
+            cached[2] = registered_shares
+
+    def _check_alerts(self, prices):
+        # prices is an iterable of (company_name, share_price); a bisect per company, no queries
+        fired = []
+        for company_name, price in prices:
+            fired += self.alert_book.check(company_name, price)
+        if fired:
+            metrics.inc("alerts_fired_total", len(fired))
+            if self.on_alerts:
+                self.on_alerts(fired)
+
+    async def add_alert(self, user_id: str, company_name: str, threshold: float):
+        # The alert fires when the price crosses threshold from where it is now
+        company = self._cached_company(company_name)
+        if not company:
+            raise ValueError(f"Company '{company_name}' does not exist.")
+        price = company[0]
+        if threshold <= 0:
+            raise ValueError("The alert price must be greater than 0.")
+        if threshold == price:
+            raise ValueError(f"{company_name} is already at {price:,}.")
+        direction = ABOVE if threshold > price else BELOW
+
+        async with self.pool.writer() as db:
+            # Counted from the book, not the table: fired alerts linger there until the notifier deletes them.
+            # Checked under the write lock, and the book is updated before anyone else can take it.
+            if self.alert_book.count(user_id) >= MAX_ALERTS_PER_USER:
+                raise ValueError(f"You can have at most {MAX_ALERTS_PER_USER} alerts. Remove one first.")
+            cursor = await db.execute("""
+                INSERT INTO alerts (user_id, company_name, direction, threshold, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (str(user_id), company_name, direction, threshold, int(time.time())))
+            alert_id = cursor.lastrowid
+        self.alert_book.add(alert_id, user_id, company_name, direction, threshold)
+        return alert_id, direction, price
+
+    async def get_user_alerts(self, user_id: str):
+        async with self.pool.reader() as db:
+            async with db.execute("""
+                SELECT alert_id, company_name, direction, threshold, created_at
+                FROM alerts
+                WHERE user_id = ?
+                ORDER BY alert_id
+            """, (str(user_id),)) as cursor:
+                rows = await cursor.fetchall()
+        # Skip alerts that have fired but whose rows the notifier hasn't deleted yet
+        return [row for row in rows if row[0] in self.alert_book.alerts]
+
+    async def remove_alert(self, user_id: str, alert_id: int):
+        async with self.pool.writer() as db:
+            cursor = await db.execute("DELETE FROM alerts WHERE alert_id = ? AND user_id = ?", (alert_id, str(user_id)))
+            removed = cursor.rowcount > 0
+        if removed:
+            self.alert_book.remove(alert_id)
+        return removed
+
+    async def delete_alerts(self, alert_ids):
+        # Fired alerts are one-shot; the notifier clears them in batches
+        async with self.pool.writer() as db:
+            await db.executemany("DELETE FROM alerts WHERE alert_id = ?", [(alert_id,) for alert_id in alert_ids])
 
-            await db.execute("""
-                UPDATE total_shares
-                SET total_shares = ?
-                WHERE company_name = ?
-            """, (new_total_shares, company_name))
-            await db.commit()
-            
     async def add_shares(self, company_name: str, registered_share: int):
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self.pool.writer() as db:
             await db.execute("""
             INSERT INTO registered_shares (company_name, registered_share)
             VALUES (?, ?)
             ON CONFLICT(company_name) DO UPDATE SET registered_share = excluded.registered_share
             """, (company_name, registered_share))
-            await db.commit()
+        self._update_cached_company(company_name, registered_shares=registered_share)
 
-            
     async def get_shares(self, company_name: str):
-        async with aiosqlite.connect(self.db_name) as db:
+        cached = self._cached_company(company_name)
+        if cached:
+            return cached[2]
+        if self.companies is not None:
+            return None
+
+        async with self.pool.reader() as db:
             async with db.execute("""
             SELECT registered_share FROM registered_shares WHERE company_name = ?
             """, (company_name,)) as cursor:
                 result = await cursor.fetchone()
                 return result[0] if result else None
-            
+
     async def get_all_trades(self):
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self.pool.reader() as db:
             async with db.execute("""
             SELECT trade_id, seller_id, company_name, shares_available, price_per_share
             FROM trades
+            WHERE side = 'ask'
             """) as cursor:
                 result = await cursor.fetchall()
                 return result
+    async def get_trades_page(self, company_name: str = None, seller_id=None, min_price: float = None, max_price: float = None, after=None, limit: int = 10, side: str = ASK):
+        # Keyset pagination: after is the (price_per_share, trade_id) of the previous page's last row,
+        # so every page is a bounded index range read however many trades are listed
+        clauses = ["side = ?"]
+        params = [side]
+        if company_name is not None:
+            clauses.append("company_name = ?")
+            params.append(company_name)
+        if seller_id is not None:
+            clauses.append("seller_id = ?")
+            params.append(seller_id)
+        if min_price is not None:
+            clauses.append("price_per_share >= ?")
+            params.append(min_price)
+        if max_price is not None:
+            clauses.append("price_per_share <= ?")
+            params.append(max_price)
+        if after is not None:
+            clauses.append("(price_per_share, trade_id) > (?, ?)")
+            params.extend(after)
+
+        async with self.pool.reader() as db:
+            async with db.execute(f"""
+            SELECT trade_id, seller_id, company_name, shares_available, price_per_share, to_user_id
+            FROM trades
+            WHERE {" AND ".join(clauses)}
+            ORDER BY price_per_share, trade_id
+            LIMIT ?
+            """, (*params, limit + 1)) as cursor:
+                rows = await cursor.fetchall()
+        # One extra row tells the caller whether a next page exists
+        return rows[:limit], len(rows) > limit
+
     async def create_trade(self, company_name: str, seller_id: int, num_shares: int, price_per_share: float, to_user_id: int = None):
-        async with aiosqlite.connect(self.db_name) as db:
-            await db.execute("""
-            INSERT INTO trades (company_name, seller_id, shares_available, price_per_share, to_user_id)
-            VALUES (?, ?, ?, ?, ?)
-            """, (company_name, seller_id, num_shares, price_per_share, to_user_id))
-            await db.commit()
-            
+        async with self.pool.writer() as db:
+            cursor = await db.execute("""
+            INSERT INTO trades (company_name, seller_id, shares_available, price_per_share, to_user_id, side, created_at)
+            VALUES (?, ?, ?, ?, ?, 'ask', ?)
+            """, (company_name, seller_id, num_shares, price_per_share, to_user_id, int(time.time())))
+            trade_id = cursor.lastrowid
+        # Direct trades stay off the public book
+        if to_user_id is None:
+            self.get_order_book(company_name).add(Order(trade_id, seller_id, company_name, ASK, price_per_share, num_shares))
+        return trade_id
+
     async def delete_trade(self, trade_id: int):
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self.pool.writer() as db:
             # Remove the trade from the trades table
             await db.execute("DELETE FROM trades WHERE trade_id = ?", (trade_id,))
-            await db.commit()
+        for book in self.order_books.values():
+            book.remove(trade_id)
+
     async def get_trade(self, trade_id: int):
-        async with aiosqlite.connect(self.db_name) as db:
+        async with self.pool.reader() as db:
             async with db.execute("""
-            SELECT trade_id, seller_id, company_name, shares_available, price_per_share, to_user_id
+            SELECT trade_id, seller_id, company_name, shares_available, price_per_share, to_user_id, side
             FROM trades
             WHERE trade_id = ?
             """, (trade_id,)) as cursor:
@@ -364,6 +1078,458 @@ class DatabaseUser:
                     "company_name": result[2],
                     "shares_available": result[3],
                     "price_per_share": result[4],
-                    "to_user_id": result[5]
+                    "to_user_id": result[5],
+                    "side": result[6]
                     }
                 return None
+
+    async def _fetch_credits(self, db, user_id):
+        async with db.execute("SELECT credits FROM users WHERE user_id = ?", (user_id,)) as cursor:
+            result = await cursor.fetchone()
+            return result[0] if result and result[0] is not None else 0
+
+    async def _fetch_shares(self, db, user_id, company_name: str):
+        async with db.execute("""
+            SELECT shares FROM user_shares WHERE user_id = ? AND company_name = ?
+        """, (user_id, company_name)) as cursor:
+            result = await cursor.fetchone()
+            return result[0] if result else 0
+
+    async def _settle_fill(self, db, buyer_id, seller_id, company_name: str, shares: int, price: float, trade_id: int = None):
+        # Moves credits buyer -> seller and shares seller -> buyer; caller holds the write transaction
+        cost = round(shares * price, 2)
+        await self._move_credits(db, buyer_id, -cost, "fill", trade_id)
+        await self._move_credits(db, seller_id, cost, "fill", trade_id)
+        await self._move_shares(db, seller_id, company_name, -shares, "fill", trade_id)
+        await self._move_shares(db, buyer_id, company_name, shares, "fill", trade_id)
+        return cost
+
+    async def _record(self, db, movements, reason: str, ref=None):
+        # Appends (user_id, company_name, delta) movements to the ledger in the caller's transaction
+        ts = int(time.time())
+        await db.executemany("""
+            INSERT INTO ledger (ts, user_id, company_name, delta, reason, ref)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [(ts, str(user_id), company_name, delta, reason, None if ref is None else str(ref))
+              for user_id, company_name, delta in movements if delta])
+
+    async def _move_credits(self, db, user_id, amount, reason: str, ref=None):
+        # Unregistered users have no balance to move, so nothing is recorded for them
+        cursor = await db.execute("UPDATE users SET credits = credits + ? WHERE user_id = ?", (amount, user_id))
+        if cursor.rowcount:
+            await self._record(db, [(user_id, CREDITS, amount)], reason, ref)
+
+    async def _move_shares(self, db, user_id, company_name: str, change: int, reason: str, ref=None):
+        await db.execute("""
+            INSERT INTO user_shares (user_id, company_name, shares)
+            VALUES (?, ?, ?)
+            ON CONFLICT(user_id, company_name) DO UPDATE SET shares = shares + excluded.shares
+        """, (user_id, company_name, change))
+        await self._record(db, [(user_id, company_name, change)], reason, ref)
+
+    def _record_fill(self, buyer_id, seller_id, company_name: str, shares: int, cost: float):
+        # Leaderboard side of _settle_fill, applied once the transaction has committed
+        self.leaderboard.add_credits(buyer_id, -cost)
+        self.leaderboard.add_credits(seller_id, cost)
+        self.leaderboard.add_shares(seller_id, company_name, -shares)
+        self.leaderboard.add_shares(buyer_id, company_name, shares)
+
+    async def _reduce_order(self, db, trade_id: int, remaining: int):
+        if remaining > 0:
+            await db.execute("UPDATE trades SET shares_available = ? WHERE trade_id = ?", (remaining, trade_id))
+        else:
+            await db.execute("DELETE FROM trades WHERE trade_id = ?", (trade_id,))
+
+    async def place_order(self, user_id, company_name: str, side: str, num_shares: int, limit_price: float = None, rest: bool = True):
+        # Matches against the opposite side of the company's book in price-time priority.
+        # With rest=True the unfilled remainder of a limit order is left on the book.
+        if num_shares <= 0:
+            raise ValueError("Number of shares must be positive.")
+        if limit_price is not None and limit_price <= 0:
+            raise ValueError("Price must be positive.")
+        if rest and limit_price is None:
+            raise ValueError("A resting order needs a limit price.")
+        self._check_company(company_name)
+
+        user_id = str(user_id)
+        book = self.get_order_book(company_name)
+        opposite = BID if side == ASK else ASK
+
+        async with self.lanes.lane(company_name):
+            taken = []  # Orders popped off the heap while matching
+            remaining_by_order = {}  # trade_id -> shares left after this match
+            fills = []
+            remaining = num_shares
+            resting_id = None
+
+            try:
+                async with self.pool.writer() as db:
+                    if side == ASK and await self._fetch_shares(db, user_id, company_name) < num_shares:
+                        raise ValueError("You don't have enough shares to sell.")
+                    if side == BID and rest and await self._fetch_credits(db, user_id) < num_shares * limit_price:
+                        raise ValueError("You don't have enough credits to back this bid.")
+
+                    while remaining > 0:
+                        maker = book.pop_best(opposite)
+                        if maker is None:
+                            break
+                        taken.append(maker)
+
+                        if limit_price is not None and (maker.price > limit_price if side == BID else maker.price < limit_price):
+                            break  # Best price no longer crosses; maker goes back untouched
+                        if maker.user_id == user_id:
+                            continue  # Never match against your own order
+
+                        shares = min(remaining, maker.shares)
+                        buyer_id, seller_id = (user_id, maker.user_id) if side == BID else (maker.user_id, user_id)
+
+                        # Orders aren't escrowed: a maker that can no longer cover its order is dropped
+                        if await self._fetch_credits(db, buyer_id) < round(shares * maker.price, 2):
+                            if buyer_id == user_id:
+                                break
+                            remaining_by_order[maker.trade_id] = 0
+                            await self._reduce_order(db, maker.trade_id, 0)
+                            continue
+                        if maker.user_id == seller_id and await self._fetch_shares(db, seller_id, company_name) < shares:
+                            remaining_by_order[maker.trade_id] = 0
+                            await self._reduce_order(db, maker.trade_id, 0)
+                            continue
+
+                        cost = await self._settle_fill(db, buyer_id, seller_id, company_name, shares, maker.price, maker.trade_id)
+                        remaining_by_order[maker.trade_id] = maker.shares - shares
+                        await self._reduce_order(db, maker.trade_id, maker.shares - shares)
+                        fills.append((maker.trade_id, maker.user_id, shares, maker.price, cost))
+                        remaining -= shares
+
+                    if remaining > 0 and rest:
+                        cursor = await db.execute("""
+                            INSERT INTO trades (company_name, seller_id, shares_available, price_per_share, to_user_id, side, created_at)
+                            VALUES (?, ?, ?, ?, NULL, ?, ?)
+                        """, (company_name, user_id, remaining, limit_price, side, int(time.time())))
+                        resting_id = cursor.lastrowid
+            except BaseException:
+                # Rolled back: every order goes back on the book as it was
+                for order in taken:
+                    book.restore(order)
+                raise
+
+            # Committed: apply the fills to the in-memory book
+            for order in taken:
+                left = remaining_by_order.get(order.trade_id, order.shares)
+                if left > 0:
+                    order.shares = left
+                    book.restore(order)
+                else:
+                    book.remove(order.trade_id)
+            if resting_id is not None:
+                book.add(Order(resting_id, user_id, company_name, side, limit_price, remaining))
+
+            for _, maker_id, shares, _, cost in fills:
+                buyer_id, seller_id = (user_id, maker_id) if side == BID else (maker_id, user_id)
+                self._record_fill(buyer_id, seller_id, company_name, shares, cost)
+
+        return {
+            "fills": fills,  # (trade_id, maker_id, shares, price, cost)
+            "filled": num_shares - remaining,
+            "total": round(sum(fill[4] for fill in fills), 2),
+            "remaining": remaining,
+            "resting_id": resting_id
+        }
+
+    async def fill_trade(self, trade_id: int, buyer_id, num_shares: int):
+        # Buy directly from a listed ask by id, e.g. a direct trade addressed to the buyer
+        if num_shares <= 0:
+            raise ValueError("Number of shares must be positive.")
+        buyer_id = str(buyer_id)
+        trade = await self.get_trade(trade_id)
+        if not trade or trade["side"] != ASK:
+            raise ValueError("Trade not found. Please check the trade ID.")
+
+        book = self.get_order_book(trade["company_name"])
+        async with self.lanes.lane(trade["company_name"]):
+            async with self.pool.writer() as db:
+                # Re-read inside the transaction; the listing may have changed since
+                async with db.execute("""
+                    SELECT seller_id, company_name, shares_available, price_per_share, to_user_id
+                    FROM trades WHERE trade_id = ?
+                """, (trade_id,)) as cursor:
+                    result = await cursor.fetchone()
+                if not result:
+                    raise ValueError("Trade not found. Please check the trade ID.")
+                seller_id, company_name, shares_available, price_per_share, to_user_id = result
+                seller_id = str(seller_id)
+
+                if to_user_id and str(to_user_id) != buyer_id:
+                    raise ValueError(f"This trade is only available to <@{to_user_id}>.")
+                if seller_id == buyer_id:
+                    raise ValueError("You cannot buy your own trade.")
+                if num_shares > shares_available:
+                    raise ValueError(f"Not enough shares available. Only {shares_available} shares are left.")
+                total_price = round(num_shares * price_per_share, 2)
+                if await self._fetch_credits(db, buyer_id) < total_price:
+                    raise ValueError(f"You don't have enough credits to buy {num_shares} shares of {company_name}. Total cost is ${total_price:,}.")
+                if await self._fetch_shares(db, seller_id, company_name) < num_shares:
+                    raise ValueError("The seller no longer holds enough shares for this trade.")
+
+                await self._settle_fill(db, buyer_id, seller_id, company_name, num_shares, price_per_share, trade_id)
+                await self._reduce_order(db, trade_id, shares_available - num_shares)
+
+            self._record_fill(buyer_id, seller_id, company_name, num_shares, total_price)
+            order = book.orders.get(trade_id)
+            if order:
+                order.shares = shares_available - num_shares
+                if order.shares <= 0:
+                    book.remove(trade_id)
+
+        return {
+            "company_name": company_name,
+            "seller_id": seller_id,
+            "total": total_price,
+            "remaining": shares_available - num_shares
+        }
+
+    async def cancel_order(self, trade_id: int, user_id):
+        async with self.pool.writer() as db:
+            cursor = await db.execute("DELETE FROM trades WHERE trade_id = ? AND seller_id = ?", (trade_id, user_id))
+            cancelled = cursor.rowcount > 0
+        if cancelled:
+            for book in self.order_books.values():
+                book.remove(trade_id)
+        return cancelled
+
+    async def pay_dividend(self, company_name: str, payer_id, amount_per_share: float):
+        async with self.pool.writer() as db:
+            result, credited = await self._pay_dividend(db, company_name, payer_id, amount_per_share)
+        self._record_dividend(result, credited)
+        return result
+
+    async def _pay_dividend(self, db, company_name: str, payer_id, amount_per_share: float, ref=None):
+        # Pays amount_per_share on every share held by registered users other than the owner, in the
+        # caller's transaction. Every check comes before the first write, so a ValueError leaves
+        # nothing behind. The credit and its ledger entries are one set-based statement each.
+        if amount_per_share <= 0:
+            raise ValueError("The dividend per share must be greater than 0.")
+        company = self._cached_company(company_name)
+        if not company:
+            raise ValueError(f"Company '{company_name}' does not exist.")
+        payer_id = str(payer_id)
+        if company[3] != payer_id:
+            raise ValueError(f"Only the owner of {company_name} can pay its dividends.")
+        ref = None if ref is None else str(ref)
+
+        async with db.execute("""
+            SELECT us.user_id, us.shares
+            FROM user_shares us
+            JOIN users u ON u.user_id = us.user_id
+            WHERE us.company_name = ? AND us.shares > 0 AND us.user_id != ?
+        """, (company_name, payer_id)) as cursor:
+            holders = await cursor.fetchall()
+        if not holders:
+            raise ValueError(f"{company_name} has no shareholders to pay.")
+        shares = sum(held for _, held in holders)
+        total = amount_per_share * shares
+        if await self._fetch_credits(db, payer_id) < total:
+            raise ValueError(f"Paying {amount_per_share:,} on {shares:,} shares costs {total:,}, which is more than you have.")
+
+        await self._move_credits(db, payer_id, -total, "dividend_paid", ref)
+        # Correlated subquery rather than UPDATE ... FROM, which needs SQLite 3.33+
+        await db.execute("""
+            UPDATE users SET credits = credits + ? * (
+                SELECT us.shares FROM user_shares us
+                WHERE us.user_id = users.user_id AND us.company_name = ?
+            )
+            WHERE user_id IN (
+                SELECT user_id FROM user_shares
+                WHERE company_name = ? AND shares > 0 AND user_id != ?
+            )
+        """, (amount_per_share, company_name, company_name, payer_id))
+        await db.execute("""
+            INSERT INTO ledger (ts, user_id, company_name, delta, reason, ref)
+            SELECT ?, us.user_id, ?, ? * us.shares, 'dividend', ?
+            FROM user_shares us
+            JOIN users u ON u.user_id = us.user_id
+            WHERE us.company_name = ? AND us.shares > 0 AND us.user_id != ?
+        """, (int(time.time()), CREDITS, amount_per_share, ref, company_name, payer_id))
+
+        result = {
+            "company_name": company_name,
+            "payer_id": payer_id,
+            "amount_per_share": amount_per_share,
+            "holders": len(holders),
+            "shares": shares,
+            "total": total
+        }
+        credited = [(payer_id, -total)] + [(user_id, amount_per_share * held) for user_id, held in holders]
+        return result, credited
+
+    def _record_dividend(self, result, credited):
+        # Leaderboard side of _pay_dividend, applied once the transaction has committed
+        self.leaderboard.add_credits_many(credited)
+        metrics.inc("dividend_credits_total", result["holders"])
+
+    async def schedule_payout(self, company_name: str, user_id, amount_per_share: float, interval_seconds: int):
+        # The first payment is one interval from now
+        if amount_per_share <= 0:
+            raise ValueError("The dividend per share must be greater than 0.")
+        company = self._cached_company(company_name)
+        if not company:
+            raise ValueError(f"Company '{company_name}' does not exist.")
+        if company[3] != str(user_id):
+            raise ValueError(f"Only the owner of {company_name} can pay its dividends.")
+        next_run = int(time.time()) + interval_seconds
+        async with self.pool.writer() as db:
+            cursor = await db.execute("""
+                INSERT INTO payouts (company_name, user_id, amount_per_share, interval_seconds, next_run)
+                VALUES (?, ?, ?, ?, ?)
+            """, (company_name, str(user_id), amount_per_share, interval_seconds, next_run))
+            return cursor.lastrowid, next_run
+
+    async def get_payouts(self, user_id):
+        async with self.pool.reader() as db:
+            async with db.execute("""
+                SELECT payout_id, company_name, amount_per_share, interval_seconds, next_run
+                FROM payouts
+                WHERE user_id = ?
+                ORDER BY payout_id
+            """, (str(user_id),)) as cursor:
+                return await cursor.fetchall()
+
+    async def cancel_payout(self, payout_id: int, user_id):
+        async with self.pool.writer() as db:
+            cursor = await db.execute("DELETE FROM payouts WHERE payout_id = ? AND user_id = ?", (payout_id, str(user_id)))
+            return cursor.rowcount > 0
+
+    async def run_due_payouts(self, now: int = None):
+        # Pays every scheduled dividend that has come due. One that can't be paid (say the owner
+        # is short of credits) is skipped until its next run rather than retried every loop.
+        now = int(time.time()) if now is None else now
+        async with self.pool.reader() as db:
+            async with db.execute("""
+                SELECT payout_id FROM payouts WHERE next_run <= ? ORDER BY next_run
+            """, (now,)) as cursor:
+                due = await cursor.fetchall()
+
+        results = []
+        for (payout_id,) in due:
+            try:
+                results.append((payout_id, await self._run_payout(payout_id, now)))
+            except Exception as e:
+                # Nothing was committed, so the payout is retried on the next loop
+                results.append((payout_id, e))
+        return results
+
+    async def _run_payout(self, payout_id: int, now: int):
+        # The payment and the move to next_run commit together, so a restart can't pay a run twice
+        credited = None
+        async with self.pool.writer() as db:
+            async with db.execute("""
+                SELECT company_name, user_id, amount_per_share, interval_seconds, next_run
+                FROM payouts
+                WHERE payout_id = ? AND next_run <= ?
+            """, (payout_id, now)) as cursor:
+                row = await cursor.fetchone()
+            if row is None:
+                return None  # Cancelled, or already paid since it was listed
+            company_name, user_id, amount_per_share, interval, next_run = row
+            try:
+                result, credited = await self._pay_dividend(db, company_name, user_id, amount_per_share, ref=payout_id)
+            except ValueError as e:
+                result = e
+            # Runs missed while the bot was down are not paid out in a burst
+            next_run += ((now - next_run) // interval + 1) * interval
+            await db.execute("UPDATE payouts SET next_run = ? WHERE payout_id = ?", (next_run, payout_id))
+        if credited is not None:
+            self._record_dividend(result, credited)
+        return result
+
+    async def get_ledger_page(self, user_id, before: int = None, limit: int = 10):
+        # Newest first; before is the entry_id of the previous page's last row
+        async with self.pool.reader() as db:
+            async with db.execute("""
+                SELECT entry_id, ts, company_name, delta, reason, ref
+                FROM ledger
+                WHERE user_id = ? AND entry_id < ?
+                ORDER BY entry_id DESC
+                LIMIT ?
+            """, (str(user_id), before if before is not None else 2 ** 63 - 1, limit + 1)) as cursor:
+                rows = await cursor.fetchall()
+        return rows[:limit], len(rows) > limit
+
+    async def snapshot_balances(self, keep: int = SNAPSHOTS_KEPT):
+        # Copies every balance as of the newest ledger entry, so replay only reads what came after
+        async with self.pool.writer() as db:
+            async with db.execute("SELECT COALESCE(MAX(entry_id), 0) FROM ledger") as cursor:
+                entry_id = (await cursor.fetchone())[0]
+            cursor = await db.execute("INSERT INTO balance_snapshots (entry_id, ts) VALUES (?, ?)", (entry_id, int(time.time())))
+            snapshot_id = cursor.lastrowid
+            await db.execute("""
+                INSERT INTO snapshot_balances (snapshot_id, user_id, company_name, balance)
+                SELECT ?, user_id, '', credits FROM users WHERE credits != 0
+                UNION ALL
+                SELECT ?, user_id, company_name, shares FROM user_shares WHERE shares != 0
+            """, (snapshot_id, snapshot_id))
+            await db.execute("DELETE FROM snapshot_balances WHERE snapshot_id <= ?", (snapshot_id - keep,))
+            await db.execute("DELETE FROM balance_snapshots WHERE snapshot_id <= ?", (snapshot_id - keep,))
+        return snapshot_id
+
+    async def _replay(self, db, user_id=None):
+        # Latest snapshot plus the ledger after it, in one statement: {(user_id, company_name): balance}
+        user_filter = "AND user_id = ?" if user_id is not None else ""
+        params = (str(user_id),) * 2 if user_id is not None else ()
+        async with db.execute(f"""
+            WITH latest AS (
+                SELECT snapshot_id, entry_id FROM balance_snapshots ORDER BY snapshot_id DESC LIMIT 1
+            )
+            SELECT user_id, company_name, SUM(amount) FROM (
+                SELECT user_id, company_name, balance AS amount FROM snapshot_balances
+                WHERE snapshot_id = (SELECT snapshot_id FROM latest) {user_filter}
+                UNION ALL
+                SELECT user_id, company_name, delta FROM ledger
+                WHERE entry_id > COALESCE((SELECT entry_id FROM latest), 0) {user_filter}
+            )
+            GROUP BY user_id, company_name
+        """, params) as cursor:
+            return {(row[0], row[1]): row[2] for row in await cursor.fetchall() if row[2]}
+
+    async def _live_balances(self, db, user_id=None):
+        user_filter = "AND user_id = ?" if user_id is not None else ""
+        params = (str(user_id),) * 2 if user_id is not None else ()
+        async with db.execute(f"""
+            SELECT user_id, '', credits FROM users WHERE credits != 0 {user_filter}
+            UNION ALL
+            SELECT user_id, company_name, shares FROM user_shares WHERE shares != 0 {user_filter}
+        """, params) as cursor:
+            return {(row[0], row[1]): row[2] for row in await cursor.fetchall()}
+
+    async def replay_balances(self, user_id=None):
+        async with self.pool.reader() as db:
+            return await self._replay(db, user_id)
+
+    async def audit_balances(self, user_id=None):
+        # Live balances that disagree with the replayed ledger: [(user_id, company_name, live, replayed)]
+        async with self.pool.reader() as db:
+            # One read transaction, so both sides see the same committed state
+            await db.execute("BEGIN")
+            try:
+                replayed = await self._replay(db, user_id)
+                live = await self._live_balances(db, user_id)
+            finally:
+                await db.execute("COMMIT")
+        return [
+            (key[0], key[1], live.get(key, 0), replayed.get(key, 0))
+            for key in sorted(set(replayed) | set(live))
+            if abs(live.get(key, 0) - replayed.get(key, 0)) >= 0.005
+        ]
+
+    async def rebuild_balances(self):
+        # Overwrites the balance columns with the replayed ledger, e.g. after corruption
+        async with self.pool.writer() as db:
+            balances = await self._replay(db)
+            await db.execute("UPDATE users SET credits = 0")
+            await db.executemany("UPDATE users SET credits = ? WHERE user_id = ?",
+                                 [(balance, user_id) for (user_id, company_name), balance in balances.items() if company_name == CREDITS])
+            await db.execute("DELETE FROM user_shares")
+            await db.executemany("INSERT INTO user_shares (user_id, company_name, shares) VALUES (?, ?, ?)",
+                                 [(user_id, company_name, int(round(balance))) for (user_id, company_name), balance in balances.items() if company_name != CREDITS])
+        await self._load_leaderboard()
+        return len(balances)
@@ -0,0 +1,62 @@
+import asyncio
+import contextlib
+import time
+from metrics import metrics
+
+
+class Lane:
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = asyncio.Lock()
+        self.depth = 0  # Tasks waiting for or holding the lane
+        self.max_depth = 0
+        self.acquired = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class Lanes:
+    # One FIFO lock per company: orders for a company run one at a time, in arrival order,
+    # while different companies proceed independently
+    def __init__(self):
+        self.lanes = {}  # company_name -> Lane
+
+    def get(self, name: str):
+        lane = self.lanes.get(name)
+        if lane is None:
+            lane = self.lanes[name] = Lane(name)
+        return lane
+
+    @contextlib.asynccontextmanager
+    async def lane(self, name: str):
+        lane = self.get(name)
+        lane.depth += 1
+        lane.max_depth = max(lane.max_depth, lane.depth)
+        metrics.set_gauge("lane_queue_depth", lane.depth, company=name)
+        start = time.perf_counter()
+        try:
+            async with lane.lock:
+                wait = time.perf_counter() - start
+                lane.acquired += 1
+                lane.wait_total += wait
+                lane.wait_max = max(lane.wait_max, wait)
+                metrics.observe("lane_wait_seconds", wait, company=name)
+                yield lane
+        finally:
+            lane.depth -= 1
+            metrics.set_gauge("lane_queue_depth", lane.depth, company=name)
+
+    def discard(self, name: str):
+        # Dropped with its company; an in-flight holder keeps its own reference
+        self.lanes.pop(name, None)
+        metrics.remove("lane_queue_depth", company=name)
+        metrics.remove("lane_wait_seconds", company=name)
+
+    def stats(self):
+        # (name, depth, max_depth, acquired, mean wait, max wait), busiest first
+        rows = [
+            (lane.name, lane.depth, lane.max_depth, lane.acquired,
+             lane.wait_total / lane.acquired if lane.acquired else 0.0, lane.wait_max)
+            for lane in self.lanes.values()
+        ]
+        return sorted(rows, key=lambda row: (row[1], row[4] * row[3]), reverse=True)
@@ -0,0 +1,122 @@
+from sortedcontainers import SortedList
+
+
+class Leaderboard:
+    # Net worth (credits + shares held x current price) of every registered user, kept sorted
+    # as (-worth, user_id) so top-N is a slice and a user's rank is one bisect; a change moves one
+    # entry in O(log n). DatabaseUser feeds it each change after the write commits. Repricings
+    # reach holders only when apply_prices runs on its timer, so reads never re-rank anything.
+    def __init__(self):
+        self.credits = {}  # user_id -> credits; only these users are ranked
+        self.holdings = {}  # user_id -> {company_name: shares}
+        self.holders = {}  # company_name -> set of user_ids holding it
+        self.prices = {}  # company_name -> share price
+        self.worth = {}  # user_id -> net worth as currently ranked
+        self.ranking = SortedList()  # (-worth, user_id)
+        self.repriced = set()  # Companies whose holders are re-ranked by the next apply_prices
+
+    def load(self, users, holdings, prices):
+        # users: (user_id, credits); holdings: (user_id, company_name, shares); prices: (company_name, price)
+        self.credits = {str(user_id): credits or 0 for user_id, credits in users}
+        self.prices = dict(prices)
+        self.holdings = {}
+        self.holders = {}
+        for user_id, company_name, shares in holdings:
+            if shares:
+                self.holdings.setdefault(str(user_id), {})[company_name] = shares
+                self.holders.setdefault(company_name, set()).add(str(user_id))
+        self.worth = {user_id: self._compute(user_id) for user_id in self.credits}
+        self.ranking = SortedList((-worth, user_id) for user_id, worth in self.worth.items())
+        self.repriced = set()
+
+    def _compute(self, user_id: str):
+        held = self.holdings.get(user_id, {})
+        return round(self.credits.get(user_id, 0) + sum(shares * self.prices.get(company, 0) for company, shares in held.items()), 2)
+
+    def _rerank(self, user_id: str, worth: float):
+        old = self.worth.get(user_id)
+        if old == worth:
+            return
+        if old is not None:
+            self.ranking.remove((-old, user_id))
+        self.worth[user_id] = worth
+        self.ranking.add((-worth, user_id))
+
+    def _refresh(self, user_id: str):
+        if user_id in self.credits:
+            self._rerank(user_id, self._compute(user_id))
+
+    def set_user(self, user_id, credits):
+        user_id = str(user_id)
+        self.credits[user_id] = credits or 0
+        self._refresh(user_id)
+
+    def add_credits(self, user_id, amount):
+        user_id = str(user_id)
+        if user_id in self.credits:
+            self.credits[user_id] += amount
+            self._refresh(user_id)
+
+    def add_credits_many(self, amounts):
+        # amounts: (user_id, amount), e.g. every holder credited by one dividend
+        for user_id, amount in amounts:
+            user_id = str(user_id)
+            if user_id in self.credits:
+                self.credits[user_id] += amount
+                self._refresh(user_id)
+
+    def add_shares(self, user_id, company_name: str, shares_change: int):
+        user_id = str(user_id)
+        held = self.holdings.setdefault(user_id, {})
+        shares = held.get(company_name, 0) + shares_change
+        if shares > 0:
+            held[company_name] = shares
+            self.holders.setdefault(company_name, set()).add(user_id)
+        else:
+            held.pop(company_name, None)
+            self.holders.get(company_name, set()).discard(user_id)
+        self._refresh(user_id)
+
+    def set_shares(self, user_id, company_name: str, shares: int):
+        current = self.holdings.get(str(user_id), {}).get(company_name, 0)
+        self.add_shares(user_id, company_name, shares - current)
+
+    def set_price(self, company_name: str, price: float):
+        # Every trade reprices its company, so the holders are re-ranked by apply_prices,
+        # once for however many trades came in between; until then they rank at the old price
+        if self.prices.get(company_name) == price:
+            return
+        self.prices[company_name] = price
+        self.repriced.add(company_name)
+
+    def apply_prices(self):
+        # Called on a timer; each holder of a repriced company moves in place
+        holders = set()
+        for company_name in self.repriced:
+            holders.update(self.holders.get(company_name, ()))
+        self.repriced = set()
+        for user_id in holders:
+            self._refresh(user_id)
+
+    def remove_company(self, company_name: str):
+        self.prices.pop(company_name, None)
+        self.repriced.discard(company_name)
+        for user_id in self.holders.pop(company_name, ()):
+            self.holdings.get(user_id, {}).pop(company_name, None)
+            self._refresh(user_id)
+
+    def top(self, limit: int = 10, offset: int = 0):
+        # [(rank, user_id, worth)], rank starting at 1
+        entries = self.ranking.islice(offset, offset + limit)
+        return [(offset + i + 1, user_id, -worth) for i, (worth, user_id) in enumerate(entries)]
+
+    def rank(self, user_id):
+        # (rank, worth), or None for an unregistered user
+        user_id = str(user_id)
+        worth = self.worth.get(user_id)
+        if worth is None:
+            return None
+        return self.ranking.bisect_left((-worth, user_id)) + 1, worth
+
+    def __len__(self):
+        return len(self.ranking)
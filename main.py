@@ -7,133 +7,256 @@ import aiohttp
 import asyncio
 import random
 import string
-import numpy as np
 import io
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
 import datetime
-import pnwkit
-import concurrent.futures
+import hashlib
+import json
+import time
 from db import DatabaseUser
+from pnw import PnWClient, DEFAULT_API_URL
+from charts import ChartEngine
+from analytics import Analytics, OVERLAYS, SMA_WINDOW, EMA_SPAN
+from txlog import TransactionLogger
+from alerts import AlertNotifier, MAX_ALERTS_PER_USER
+from metrics import metrics, timed_command
+import pricing
 
 # Load environment variables
 load_dotenv()
 TOKEN = os.getenv('TOKEN')
 PNW_API_KEY = os.getenv('PNW_API_KEY')
-kit = pnwkit.QueryKit(PNW_API_KEY)
-LOG_CHANNEL_ID = os.getenv('log_channel')
+pnw = PnWClient(PNW_API_KEY, base_url=os.getenv('PNW_API_URL', DEFAULT_API_URL))
+LOG_CHANNEL_ID = int(os.getenv('log_channel')) if os.getenv('log_channel') else None
 AUTHORIZED_ROLE_ID = int(os.getenv('AUTHORIZED_ROLE_ID'))
+# Raw minute history older than this is dropped; the OHLC rollups keep the summary
+HISTORY_RETENTION = datetime.timedelta(days=float(os.getenv('HISTORY_RETENTION_DAYS', '2')))
+# "changes" only stores a history row when a price moves, plus a keyframe every
+# HISTORY_KEYFRAME_MINUTES; "all" stores every company every minute
+HISTORY_RECORDING = os.getenv('HISTORY_RECORDING', 'all').lower()
+HISTORY_KEYFRAME_MINUTES = int(os.getenv('HISTORY_KEYFRAME_MINUTES', '60'))
+# Prometheus export: an HTTP endpoint on METRICS_PORT and/or a text file rewritten every 15s
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT')) if os.getenv('METRICS_PORT') else None
+METRICS_FILE = os.getenv('METRICS_FILE')
+# Set to push slash commands on every start instead of only when they change
+FORCE_COMMAND_SYNC = os.getenv('FORCE_COMMAND_SYNC', '').lower() in ('1', 'true', 'yes')
+# How often every balance is snapshotted; ledger replay starts from the newest snapshot
+BALANCE_SNAPSHOT_HOURS = float(os.getenv('BALANCE_SNAPSHOT_HOURS', '6'))
+# How stale /leaderboard may get: holders of a repriced company are re-ranked this often
+LEADERBOARD_RERANK_SECONDS = float(os.getenv('LEADERBOARD_RERANK_SECONDS', '30'))
 
 intents = discord.Intents.default()
-bot = commands.Bot(command_prefix="!", intents=intents)
-db = DatabaseUser()
+
+
+class ProfitPulseBot(commands.Bot):
+    background_tasks = set()  # Strong references to fire-and-forget tasks
+    metrics_runner = None
+
+    async def setup_hook(self):
+        # Runs once per process after login; gateway reconnects (on_ready) skip all of it
+        await db.init_db()
+        tx_log.start()
+        alert_notifier.start()
+        await sync_commands()
+        update_share_prices.start()
+        compact_share_price_history.start()
+        snapshot_balances.start()
+        run_payouts.start()
+        rerank_leaderboard.start()
+        await start_instrumentation()
+        # Short-period charts are served from memory once this finishes
+        bot.background_tasks.add(asyncio.create_task(db.warm_price_rings()))
+
+    async def close(self):
+        # Flush queued transaction logs while the gateway can still send them
+        await tx_log.stop()
+        await alert_notifier.stop()
+        await super().close()
+        # Close the pooled database and HTTP connections once the gateway is down
+        await db.close()
+        await pnw.close()
+        charts.close()
+        if self.metrics_runner:
+            await self.metrics_runner.cleanup()
+
+
+bot = ProfitPulseBot(command_prefix="!", intents=intents)
+db = DatabaseUser(record_changes_only=HISTORY_RECORDING == 'changes', keyframe_interval=HISTORY_KEYFRAME_MINUTES * 60)
+charts = ChartEngine()
+analytics = Analytics()
+# Transaction logs are batched to the log channel and mirrored to an append-only local ledger
+tx_log = TransactionLogger(lambda: bot.get_channel(LOG_CHANNEL_ID), ledger_path=os.getenv('TX_LEDGER_PATH', 'transactions.jsonl'))
+
+
+async def resolve_user(user_id: int):
+    return bot.get_user(user_id) or await bot.fetch_user(user_id)
+
+# Price moves hand fired alerts to the notifier, which batches the DMs under a send rate limit
+alert_notifier = AlertNotifier(resolve_user, db.delete_alerts)
+db.on_alerts = alert_notifier.notify
 
 
 @bot.event
 async def on_ready():
     print(f'Logged in as {bot.user}!')
-    await db.init_db()
+
+async def sync_commands():
+    # Syncing is rate limited and slow; only push the command tree when its definition changed
+    definition = json.dumps([command.to_dict(bot.tree) for command in bot.tree.get_commands()], sort_keys=True)
+    digest = hashlib.sha256(definition.encode("utf-8")).hexdigest()
+    if not FORCE_COMMAND_SYNC and await db.get_meta("command_hash") == digest:
+        return
     await bot.tree.sync()
-    update_share_prices.start()
+    await db.set_meta("command_hash", digest)
+    print("Slash commands synced")
+
+async def start_instrumentation():
+    if bot.background_tasks:
+        return  # Already started
+    task = asyncio.create_task(metrics.sample_loop_lag())
+    bot.background_tasks.add(task)
+    if METRICS_PORT:
+        bot.metrics_runner = await metrics.serve(METRICS_HOST, METRICS_PORT)
+    if METRICS_FILE and not export_metrics_file.is_running():
+        export_metrics_file.start()
+
+@tasks.loop(seconds=15)
+async def export_metrics_file():
+    await asyncio.to_thread(metrics.write_file, METRICS_FILE)
 async def log_transaction(company_name: str, num_shares: int, share_price: float, total_value: float, user_id: str, transaction_type: str):
-    log_channel = bot.get_channel(LOG_CHANNEL_ID)
-    
-    if log_channel:
-        log_message = (
-            f"{transaction_type} Transaction Log:\n"
-            f"User ID: {user_id}\n"
-            f"Company: {company_name}\n"
-            f"Shares {transaction_type}d: {num_shares}\n"
-            f"Share Price: {share_price}\n"
-            f"Total {transaction_type} Value: {total_value}\n"
-            f"Time: {datetime.datetime.now().isoformat()}"
-        )
-        await log_channel.send(log_message)
-    else:
-        print(f"Log channel with ID {LOG_CHANNEL_ID} not found.")
-        
-
-async def generate_graph_in_background(company_name, times, prices, period):
-    loop = asyncio.get_event_loop()
-    with concurrent.futures.ThreadPoolExecutor() as pool:
-        return await loop.run_in_executor(pool, lambda: create_and_save_graph(company_name, times, prices, period))
-
-def create_and_save_graph(company_name, times, prices, period):
-    # Create the plot
-    plt.figure(figsize=(10, 5))
-
-    # Plot with different colors based on price direction
-    for i in range(1, len(prices)):
-        if prices[i] > prices[i - 1]:
-            plt.plot([times[i-1], times[i]], [prices[i-1], prices[i]], color='green', linewidth=2, marker='o')
-        else:
-            plt.plot([times[i-1], times[i]], [prices[i-1], prices[i]], color='red', linewidth=2, marker='o')
-
-    # Format and style the graph
-    plt.title(f"Share Price History for {company_name} ({period})")
-    plt.xlabel('Time')
-    plt.ylabel('Share Price')
-    plt.grid(True)
-    plt.xticks(rotation=45)
-
-    # Adjust the x-axis to show only key time points, not cluttered data
-    if period in ['1h', '12h']:
-        plt.gca().xaxis.set_major_locator(plt.MaxNLocator(10))  # Adjust for shorter periods
-    elif period in ['1d', '3d', '7d']:
-        plt.gca().xaxis.set_major_locator(plt.MaxNLocator(6))  # Adjust for longer periods
-
-    # Save the plot to a BytesIO object
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plt.close()
-
-    return buf
+    # Only enqueues; the logger worker batches the Discord messages and the ledger writes
+    tx_log.log({
+        "type": transaction_type,
+        "user_id": str(user_id),
+        "company": company_name,
+        "shares": num_shares,
+        "share_price": share_price,
+        "total": total_value,
+        "time": datetime.datetime.now().isoformat()
+    })
+
+def log_dividend(result):
+    # One summary entry per payout, however many holders it credited
+    tx_log.log({
+        "type": "Dividend",
+        "user_id": result["payer_id"],
+        "company": result["company_name"],
+        "shares": result["shares"],
+        "share_price": result["amount_per_share"],
+        "total": result["total"],
+        "holders": result["holders"],
+        "time": datetime.datetime.now().isoformat()
+    })
+
+async def company_autocomplete(interaction: discord.Interaction, current: str):
+    # Answered from the in-memory name index; autocomplete fires on every keystroke
+    return [app_commands.Choice(name=name, value=name) for name in db.company_index.search(current)]
 
 @bot.tree.command(name="share_price_graph", description="Get a graph of share prices over a specific period.")
-@app_commands.describe(company_name="Graph of the company", period="1h,12h,1d,3d,7d")
-async def share_price_graph(interaction: discord.Interaction, company_name: str, period: str):
+@app_commands.describe(company_name="Graph of the company", period="1h,12h,1d,3d,7d", overlay="Moving average to draw over the price")
+@app_commands.choices(overlay=[app_commands.Choice(name=name, value=name) for name in OVERLAYS])
+@app_commands.autocomplete(company_name=company_autocomplete)
+@timed_command
+async def share_price_graph(interaction: discord.Interaction, company_name: str, period: str, overlay: str = None):
     await interaction.response.defer()
     try:
-        price_data = await db.get_share_price_history(company_name, period)
+        # History only changes on a price tick, so a chart rendered since the last tick is reused as-is
+        snapshot_ts = db.last_snapshot_ts
+        png = charts.get_cached(company_name, period, snapshot_ts, overlay)
 
-        if not price_data:
-            await interaction.followup.send(f"No price history found for {company_name}.", ephemeral=True)
-            return
+        if png is None:
+            series = await db.get_price_series(company_name, period)
+
+            if not series:
+                await interaction.followup.send(f"No price history found for {company_name}.", ephemeral=True)
+                return
 
-        times, prices = zip(*[(time, price) for date, time, price in price_data])
+            timestamps, prices = series
+            png = await charts.render(company_name, period, snapshot_ts, timestamps, prices, overlay)
 
-        buf = await generate_graph_in_background(company_name, times, prices, period)
-        file = discord.File(fp=buf, filename=f"{company_name}_price_history.png")
+        file = discord.File(fp=io.BytesIO(png), filename=f"{company_name}_price_history.png")
         await interaction.followup.send(file=file)
 
     except Exception as e:
         await interaction.followup.send(f"An error occurred while generating the graph: {str(e)}", ephemeral=True)
 
+@bot.tree.command(name="analyze", description="Technical indicators for a company's share price.")
+@app_commands.describe(company_name="Name of the company", period="1h,12h,1d,3d,7d")
+@app_commands.autocomplete(company_name=company_autocomplete)
+@timed_command
+async def analyze(interaction: discord.Interaction, company_name: str, period: str = "1d"):
+    # Cached until the next price tick; the tick is taken before the read, as for charts
+    snapshot_ts = db.last_snapshot_ts
+    result = analytics.get_cached(company_name, period, snapshot_ts)
+    if result is None:
+        series = await db.get_price_series(company_name, period)
+        if not series:
+            await interaction.response.send_message(f"No price history found for {company_name}.", ephemeral=True)
+            return
+        result = analytics.compute(company_name, period, snapshot_ts, series[1])
+
+    embed = discord.Embed(title=f"{company_name} Analysis ({period})", color=discord.Color.blue())
+    embed.add_field(name="Last", value=f"{result['last']:,}", inline=True)
+    embed.add_field(name="Change", value=f"{result['change_pct']:+,}%", inline=True)
+    embed.add_field(name="High / Low", value=f"{result['high']:,} / {result['low']:,}", inline=True)
+    embed.add_field(name=f"SMA({SMA_WINDOW})", value=f"{result['sma']:,}", inline=True)
+    embed.add_field(name=f"EMA({EMA_SPAN})", value=f"{result['ema']:,}", inline=True)
+    embed.add_field(name="Volatility", value=f"{result['volatility_pct']}%", inline=True)
+    embed.add_field(name="Max Drawdown", value=f"{result['max_drawdown_pct']}%", inline=True)
+    embed.set_footer(text=f"{result['points']} data points")
+    await interaction.response.send_message(embed=embed)
+
 @tasks.loop(minutes=1)
 async def update_share_prices():
+    start = time.perf_counter()
     # Fetch all companies
     companies = await db.get_all_companies()
-    
-    # Loop through all companies and record their current prices
-    for company in companies:
-        company_name = company[0]
-        share_price = company[1]
-        current_date = datetime.date.today().isoformat()
-        current_time = datetime.datetime.now().strftime('%H:%M:%S')  # Get current time
-        
-        print(f"Storing {company_name} share price: {share_price} at {current_time}")
-        
-        # Store the current share price in history
-        await db.store_share_price_history(company_name, current_date, current_time, share_price)
+
+    # Align to the minute so a restarted loop can't record the same tick twice
+    current_ts = int(time.time()) // 60 * 60
+
+    # Record every company's current price in one batched write
+    await db.store_share_price_snapshot(current_ts, [(company[0], company[1]) for company in companies])
+    analytics.invalidate(db.last_snapshot_ts)  # Indicators are recomputed from the new history on demand
+    metrics.observe("tick_seconds", time.perf_counter() - start)
+
+@tasks.loop(seconds=LEADERBOARD_RERANK_SECONDS)
+async def rerank_leaderboard():
+    db.leaderboard.apply_prices()
+
+@tasks.loop(hours=1)
+async def compact_share_price_history():
+    await db.compact_share_price_history(HISTORY_RETENTION)
+
+@tasks.loop(hours=BALANCE_SNAPSHOT_HOURS)
+async def snapshot_balances():
+    await db.snapshot_balances()
+
+@tasks.loop(minutes=5)
+async def run_payouts():
+    # An exception escaping a tasks.loop stops it for good, and every schedule with it
+    try:
+        results = await db.run_due_payouts()
+    except Exception as e:
+        print(f"Scheduled payouts failed: {e}")
+        return
+    for payout_id, result in results:
+        if isinstance(result, ValueError):
+            print(f"Scheduled payout {payout_id} skipped: {result}")
+        elif isinstance(result, Exception):
+            print(f"Scheduled payout {payout_id} failed, retrying next run: {result!r}")
+        elif result is not None:
+            log_dividend(result)
 
 @bot.tree.command(name="ping", description="-")
+@timed_command
 async def ping(interaction: discord.Interaction):
     latency = bot.latency * 1000
     await interaction.response.send_message(f"pong! {latency:.1f}ms")
 
 @bot.tree.command(name="who", description="Get nation information from Politics and War.")
 @app_commands.describe(nation="Provide a nation ID, nation name, or mention a user to fetch their nation information.")
+@timed_command
 async def whois(interaction: discord.Interaction, nation: str):
     # Check if the identifier is a mention
     if nation.startswith("<@") and nation.endswith(">"):
@@ -154,53 +277,38 @@ async def whois(interaction: discord.Interaction, nation: str):
             nation_id = int(nation)
         else:
             # Fetch nation by name
-            query = kit.query("nations", {"nation_name": nation}, "id, nation_name")
-            result = query.get()
-            if not result or not result.nations:
+            result = await pnw.nation_by_name(nation)
+            if not result:
                 await interaction.response.send_message("Failed to fetch nation data by name. Please check the nation name and try again.", ephemeral=True)
                 return
-            nation_id = result.nations[0].id
+            nation_id = result["id"]
 
     # Fetch the nation information from the Politics and War API using the nation ID
-    query = kit.query("nations", {"id": int(nation_id)}, "id, nation_name")
-    result = query.get()
+    result = await pnw.nation_by_id(nation_id)
 
-    if not result or not result.nations:
+    if not result:
         await interaction.response.send_message("Failed to fetch nation data. Please try again later.", ephemeral=True)
         return
 
-    nation_name = result.nations[0].nation_name
+    nation_name = result["nation_name"]
 
     # Fetch balance and company shares information
-    if await db.get_user_data_by_nation_id(nation_id):
-        balance = round(await db.get_user_credits(await db.get_user_data_by_nation_id(nation_id)),2)
-        companies = await db.get_all_companies()  # Assuming this returns a list of companies
+    registered_user_id = await db.get_user_data_by_nation_id(nation_id)
+    if registered_user_id:
+        balance = round(await db.get_user_credits(registered_user_id),2)
+        portfolio = await db.get_portfolio(registered_user_id)  # (company_name, shares, share_price, worth) rows
 
         user_shares_info = ""  # This will store all the companies and shares info
         total_worth = 0  # To store the total worth of shares for all companies
 
-        for company_data in companies:
-            # Extract company name, share price, etc. Assuming company_data is structured like (company_name, share_price, ...)
-            if isinstance(company_data, tuple):
-                company_name = company_data[0]  # Extract the company name
-                share_price = company_data[1]  # Extract the share price
-            else:
-                company_name = str(company_data)
-                share_price = 0  # In case share price is missing, default to 0
-
-            user_shares = await db.get_user_shares(user_id, company_name)
-            
-            # Calculate worth of the user's shares in this company
-            company_worth = user_shares * share_price
+        for company_name, user_shares, share_price, company_worth in portfolio:
             total_worth += company_worth  # Add to total worth across all companies
-
-            if user_shares > 0:
-                user_shares_info += (
-                    f"🏢 **{company_name}**\n"
-                    f"📊 **Shares Owned**: {user_shares}\n"
-                    f"💰 **Worth**: ${company_worth:,.2f}\n"
-                    f"🔖 **Share Price**: ${share_price:,.2f}\n\n"
-                )
+            user_shares_info += (
+                f"🏢 **{company_name}**\n"
+                f"📊 **Shares Owned**: {user_shares}\n"
+                f"💰 **Worth**: ${company_worth:,.2f}\n"
+                f"🔖 **Share Price**: ${share_price:,.2f}\n\n"
+            )
     else:
         balance = 'Not Registered'
         user_shares_info = 'No shares registered.'
@@ -223,27 +331,66 @@ async def whois(interaction: discord.Interaction, nation: str):
     # Send both embedded messages
     await interaction.response.send_message(embeds=[embed1, embed2])
 
+def format_latencies(histograms, limit: int = 10, order_by_total: bool = False):
+    # One "name: count, p50, p99" line per entry, busiest first
+    key = (lambda item: item[1].sum) if order_by_total else (lambda item: item[1].count)
+    rows = sorted(histograms.items(), key=key, reverse=True)[:limit]
+    lines = [f"`{name}`: {h.count}× p50 ≤{h.quantile(0.5) * 1000:g}ms p99 ≤{h.quantile(0.99) * 1000:g}ms" for name, h in rows]
+    return "\n".join(lines) or "No data yet."
+
+@bot.tree.command(name="stats", description="Show bot performance statistics (admin only).")
+@timed_command
+async def stats(interaction: discord.Interaction):
+    if not any(role.id == AUTHORIZED_ROLE_ID for role in interaction.user.roles):
+        await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+        return
+
+    embed = discord.Embed(title="Bot Statistics", color=discord.Color.blue())
+    embed.add_field(name="Commands", value=format_latencies(metrics.summary("command_seconds")), inline=False)
+    embed.add_field(name="Database (by total time)", value=format_latencies(metrics.summary("db_query_seconds"), order_by_total=True), inline=False)
+
+    lag = metrics.gauges.get(("event_loop_lag_seconds", ()), 0)
+    lag_histogram = metrics.histograms.get(("event_loop_lag_seconds_histogram", ()))
+    lag_p99 = lag_histogram.quantile(0.99) * 1000 if lag_histogram else 0
+    tick = metrics.histograms.get(("tick_seconds", ()))
+    renders = metrics.summary("chart_render_seconds")
+    cache = db.cache_stats()
+    embed.add_field(
+        name="Runtime",
+        value=(
+            f"**Gateway latency:** {bot.latency * 1000:.1f}ms\n"
+            f"**Event loop lag:** {lag * 1000:.1f}ms now, p99 ≤{lag_p99:g}ms\n"
+            f"**Price tick:** {f'{tick.count}× p99 ≤{tick.quantile(0.99) * 1000:g}ms' if tick else 'not run yet'}\n"
+            f"**Chart renders:** {sum(h.count for h in renders.values())}, cache {charts.hits} hits / {charts.misses} misses\n"
+            f"**Company cache:** {cache['hits']} hits / {cache['misses']} misses"
+        ),
+        inline=False
+    )
+    lanes = [
+        f"`{name}`: {depth} queued (max {max_depth}), {acquired}× wait avg {wait_avg * 1000:.1f}ms max {wait_max * 1000:.1f}ms"
+        for name, depth, max_depth, acquired, wait_avg, wait_max in db.lanes.stats()[:10]
+    ]
+    embed.add_field(name="Trading lanes", value="\n".join(lanes) or "No trades yet.", inline=False)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 @bot.tree.command(name="help", description="Shows a list of available commands.")
+@timed_command
 async def help_command(interaction: discord.Interaction):
+    # One line per command: an embed only takes 25 fields, and there are more commands than that
+    lines = [f"**/{command.name}** — {command.description or 'No description'}" for command in bot.tree.get_commands()]
     embed = discord.Embed(
         title="Available Commands",
-        description="Here are the commands you can use:",
+        description="Here are the commands you can use:\n\n" + "\n".join(lines),
         color=discord.Color.blue()
     )
 
-    for command in bot.tree.get_commands():
-        embed.add_field(
-            name=f"/{command.name}",
-            value=command.description or "No description",
-            inline=False
-        )
-
     try:
         await interaction.response.send_message(embed=embed)
     except discord.errors.InteractionResponded:
         print("Interaction has already been responded to.")
 
 @bot.tree.command(name="verify", description="Verify your nation ID.")
+@timed_command
 async def verify_command(interaction: discord.Interaction, nation_id: int):
     user_id = str(interaction.user.id)
 
@@ -258,25 +405,25 @@ async def verify_command(interaction: discord.Interaction, nation_id: int):
         return
 
     user = interaction.user.name
-    query = kit.query("nations", {"id": int(nation_id)}, "id, nation_name, discord")
-    result = query.get()
+    result = await pnw.nation_by_id(nation_id)
 
-    if not result or not result.nations:
+    if not result:
         await interaction.response.send_message("Failed to fetch nation data. Please try again later.", ephemeral=True)
         return
 
-    nation_name = result.nations[0].nation_name
-    discord = result.nations[0].discord
-    
-    if user == discord:
+    nation_name = result["nation_name"]
+    nation_discord = result["discord"]
+
+    if user == nation_discord:
         # Store nation data in db
         await db.add_user(user_id, nation_id)
         await interaction.response.send_message("Registered successfully!")
     else:
-        await interaction.response.send_message(f"Your nation Discord ({discord}) does not match your username ({user}).", ephemeral=True)
+        await interaction.response.send_message(f"Your nation Discord ({nation_discord}) does not match your username ({user}).", ephemeral=True)
 
 
 @bot.tree.command(name="add_credits", description="Add credits to a user's account.")
+@timed_command
 async def add_credits(interaction: discord.Interaction, user: discord.User, amount: int):
     # Check if the command invoker has the authorized role
     if AUTHORIZED_ROLE_ID not in [role.id for role in interaction.user.roles]:
@@ -306,6 +453,7 @@ async def add_credits(interaction: discord.Interaction, user: discord.User, amou
 
 @bot.tree.command(name="register_company", description="Register a new company.")
 @app_commands.describe(company_name="Name of the company", owner="Who owns the company", share_price="Initial share price", total_shares="Total number of shares")
+@timed_command
 async def register_company(interaction: discord.Interaction, company_name: str, owner:discord.User, share_price: float, total_shares: int):
     # Check if the company already exists
     existing_company = await db.get_company_by_name(company_name)
@@ -322,6 +470,7 @@ async def register_company(interaction: discord.Interaction, company_name: str,
     await interaction.response.send_message(f"Company `{company_name}` registered successfully with {total_shares} shares at {share_price} coins per share.")
 
 @bot.tree.command(name="list_companies", description="List all registered companies.")
+@timed_command
 async def list_companies(interaction: discord.Interaction):
     companies = await db.get_all_companies()
     
@@ -343,102 +492,101 @@ async def list_companies(interaction: discord.Interaction):
 
     await interaction.response.send_message(embed=embed)
 
+@bot.tree.command(name="leaderboard", description="Show the richest investors by net worth.")
+@app_commands.describe(limit="How many places to show (max 25)")
+@timed_command
+async def leaderboard(interaction: discord.Interaction, limit: int = 10):
+    # Served from the in-memory ranking; no queries
+    limit = max(1, min(limit, 25))
+    top = db.leaderboard.top(limit)
+    if not top:
+        await interaction.response.send_message("No registered users yet.", ephemeral=True)
+        return
+
+    embed = discord.Embed(title="Net Worth Leaderboard", color=discord.Color.gold())
+    embed.description = "\n".join(
+        f"**{rank}.** <@{user_id}> — <:CoinPulse:1279721599897178112> {worth:,.2f}" for rank, user_id, worth in top
+    )
+    mine = db.leaderboard.rank(interaction.user.id)
+    if mine:
+        rank, worth = mine
+        embed.set_footer(text=f"Your rank: {rank} of {len(db.leaderboard)} ({worth:,.2f})")
+    await interaction.response.send_message(embed=embed)
+
 @bot.tree.command(name="buy_shares", description="Buy shares in a company.")
 @app_commands.describe(company_name="Name of the company to buy shares from.", num_shares="Number of shares you will buy")
+@app_commands.autocomplete(company_name=company_autocomplete)
+@timed_command
 async def buy_shares(interaction: discord.Interaction, company_name: str, num_shares: int):
     user_id = interaction.user.id
 
     try:
-        # Fetch the company details
-        company = await db.get_company_by_name(company_name)
-        if not company:
-            await interaction.response.send_message("Invalid company name.", ephemeral=True)
-            return
-        
-        company_name, share_price, total_shares, company_owner_id = company
-
-        # Check for order size limits
-        MAX_SHARES_PER_TRANSACTION = 50  # Example limit
-        if num_shares > MAX_SHARES_PER_TRANSACTION:
-            await interaction.response.send_message(f"Cannot buy more than {MAX_SHARES_PER_TRANSACTION} shares in a single transaction.", ephemeral=True)
-            return
-        
-        if total_shares < num_shares:
-            await interaction.response.send_message(f"Not enough shares available. Available Shares: {total_shares}", ephemeral=True)
-            return
-
-        share_price = round(float(share_price), 2)
-        total_cost = round(num_shares * share_price, 2)
-
-        # Check if the user has enough balance
-        user_balance = await db.get_user_credits(user_id)
-        if user_balance < total_cost:
-            await interaction.response.send_message("You don't have enough coins to buy these shares.", ephemeral=True)
-            return
-
-        # Update the user's shares and balance
-        await db.update_user_shares(user_id, company_name, num_shares)
-        await db.update_user_credits_after_purchase(user_id, total_cost)
-
-        # Update the company's balance (add to the owner's credits)
-        await db.add_credits(company_owner_id, total_cost)
-
-        # Increase the share price slightly when shares are bought
-        new_price = round(share_price * (1 + (num_shares / total_shares) ** 1.2), 2)
-        new_shares = total_shares - num_shares
-        await db.update_company_details(company_name, new_price, new_shares)
-
-        # Log the transaction to a specific Discord channel
-        await log_transaction(company_name, num_shares, share_price, total_cost, user_id, "Buy")
-
-        await interaction.response.send_message(f"Successfully bought {num_shares} shares of {company_name} for {total_cost} coins.")
-    
+        # Balance check, share/credit updates and repricing run as one transaction
+        trade = await db.execute_trade(user_id, company_name, num_shares, "buy")
+    except ValueError as e:
+        await interaction.response.send_message(str(e), ephemeral=True)
+        return
     except Exception as e:
         # Handle any errors that occur during the transaction
         await interaction.response.send_message(f"An error occurred: {str(e)}", ephemeral=True)
+        return
 
-@bot.tree.command(name="sell_shares", description="Sell shares of a company.")
-@app_commands.describe(company_name="Name of the company to sell shares from.", num_shares="Number of shares you want to sell")
-async def sell_shares(interaction: discord.Interaction, company_name: str, num_shares: int):
-    user_id = interaction.user.id
+    # Log the transaction to a specific Discord channel
+    await log_transaction(trade["company_name"], num_shares, trade["share_price"], trade["total"], user_id, "Buy")
+
+    await interaction.response.send_message(f"Successfully bought {num_shares} shares of {trade['company_name']} for {trade['total']} coins.")
 
-    # Fetch the company details
+@bot.tree.command(name="quote", description="Preview the cost of buying or selling shares.")
+@app_commands.describe(company_name="Name of the company", num_shares="Number of shares", side="buy or sell")
+@app_commands.choices(side=[app_commands.Choice(name="buy", value="buy"), app_commands.Choice(name="sell", value="sell")])
+@app_commands.autocomplete(company_name=company_autocomplete)
+@timed_command
+async def quote(interaction: discord.Interaction, company_name: str, num_shares: int, side: str = "buy"):
     company = await db.get_company_by_name(company_name)
     if not company:
         await interaction.response.send_message("Invalid company name.", ephemeral=True)
         return
+    if num_shares <= 0:
+        await interaction.response.send_message("Number of shares must be positive.", ephemeral=True)
+        return
 
     company_name, share_price, total_shares, company_owner_id = company
-    share_price = round(float(share_price), 2)
-
-    # Check if the user has enough shares to sell
-    user_shares = await db.get_user_shares(user_id, company_name)
-    if user_shares is None or user_shares < num_shares:
-        await interaction.response.send_message("You don't have enough shares to sell.", ephemeral=True)
+    if side == "buy" and total_shares < num_shares:
+        await interaction.response.send_message(f"Not enough shares available. Available Shares: {total_shares}", ephemeral=True)
         return
 
-    # Calculate the total value of the shares being sold
-    total_value = round(num_shares * share_price, 2)
-
-    # Update the user's shares and balance
-    await db.update_user_shares(user_id, company_name, -num_shares)
-    await db.add_credits(user_id, total_value)
+    # Same pricing engine the trade itself uses; nothing is written
+    result = pricing.quote(share_price, total_shares, num_shares, side)
+    embed = discord.Embed(title=f"Quote: {side} {num_shares} shares of {company_name}", color=discord.Color.blue())
+    embed.add_field(name="Total", value=f"<:CoinPulse:1279721599897178112> {result['total']:,}", inline=False)
+    embed.add_field(name="Average Price", value=f"{result['average_price']:,}", inline=True)
+    embed.add_field(name="Current Price", value=f"{result['share_price']:,}", inline=True)
+    embed.add_field(name="Price After", value=f"{result['new_price']:,}", inline=True)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
 
-    # Update the company's balance (deduct from the owner's credits)
-    await db.update_user_credits_after_purchase(company_owner_id, total_value)
+@bot.tree.command(name="sell_shares", description="Sell shares of a company.")
+@app_commands.describe(company_name="Name of the company to sell shares from.", num_shares="Number of shares you want to sell")
+@app_commands.autocomplete(company_name=company_autocomplete)
+@timed_command
+async def sell_shares(interaction: discord.Interaction, company_name: str, num_shares: int):
+    user_id = interaction.user.id
 
-    # Reduce the share price slightly when shares are sold
-    new_price = round(share_price * (1 - (num_shares / total_shares) ** 1.2), 2)
-    new_shares = total_shares + num_shares
-    await db.update_company_details(company_name, new_price, new_shares)
+    try:
+        # Share check, credit updates and repricing run as one transaction
+        trade = await db.execute_trade(user_id, company_name, num_shares, "sell")
+    except ValueError as e:
+        await interaction.response.send_message(str(e), ephemeral=True)
+        return
 
     # Log the transaction in the specified channel
-    await log_transaction(company_name, -num_shares, share_price, total_value, user_id, "Sell")
+    await log_transaction(trade["company_name"], -num_shares, trade["share_price"], trade["total"], user_id, "Sell")
 
-    await interaction.response.send_message(f"Successfully sold {num_shares} shares of {company_name} for {total_value} coins.")
+    await interaction.response.send_message(f"Successfully sold {num_shares} shares of {trade['company_name']} for {trade['total']} coins.")
     
 @bot.tree.command(name="remove_company", description="Remove a company from the database.")
 @app_commands.describe(company_name="The name of the company to remove.")
+@app_commands.autocomplete(company_name=company_autocomplete)
+@timed_command
 async def remove_company_command(interaction: discord.Interaction, company_name: str):
     company = await db.get_company_by_name(company_name)
     if not any(role.id==AUTHORIZED_ROLE_ID for role in interaction.user.roles):
@@ -453,6 +601,8 @@ async def remove_company_command(interaction: discord.Interaction, company_name:
     
 @bot.tree.command(name="edit_company", description="Edit company details.")
 @app_commands.describe(company_name="Name of the company to edit", new_share_price="New share price", new_total_shares="New total number of shares")
+@app_commands.autocomplete(company_name=company_autocomplete)
+@timed_command
 async def edit_company(interaction: discord.Interaction, company_name: str, new_share_price: float, new_total_shares: int):
     # Check if the company exists
     company = await db.get_company_by_name(company_name)
@@ -470,6 +620,8 @@ async def edit_company(interaction: discord.Interaction, company_name: str, new_
 
 @bot.tree.command(name="update_registered_shares",description="Updates the registered shares")
 @app_commands.describe(company_name="Name of the company to edit", shares='Shares of the company')
+@app_commands.autocomplete(company_name=company_autocomplete)
+@timed_command
 async def update_registered_shares(interaction: discord.Interaction, company_name: str, shares: int):
     company = await db.get_company_by_name(company_name)
     if not any(role.id==AUTHORIZED_ROLE_ID for role in interaction.user.roles):
@@ -481,40 +633,293 @@ async def update_registered_shares(interaction: discord.Interaction, company_nam
     await db.add_shares(company_name, shares)
     await interaction.response.send_message('Updated!')
 
+MARKET_PAGE_SIZE = 10  # Well under Discord's 25-field embed limit
+
+def build_market_embed(trades, page: int):
+    # Create an embed for displaying trades
+    embed = discord.Embed(title="Available Trades", color=discord.Color.blue())
+    embed.set_footer(text=f"Page {page + 1}")
+
+    for trade_id, seller_id, company_name, shares_available, price_per_share, to_user_id in trades:
+        value = (
+            f"**Seller ID:** {seller_id}\n"
+            f"**Company:** {company_name}\n"
+            f"**Shares Available:** {shares_available}\n"
+            f"**Price per Share:** ${round(price_per_share, 2):,}"
+        )
+        if to_user_id:
+            value += f"\n**Direct to:** <@{to_user_id}>"
+        embed.add_field(name=f"Trade ID: {trade_id}", value=value, inline=False)
+
+    return embed
+
+class MarketView(discord.ui.View):
+    def __init__(self, owner_id: int, filters: dict, has_next: bool, cursor):
+        super().__init__(timeout=180)
+        self.owner_id = owner_id
+        self.filters = filters
+        self.cursors = [None, cursor]  # Keyset cursor at the start of each page visited so far
+        self.page = 0
+        self.has_next = has_next
+        self._sync_buttons()
+
+    def _sync_buttons(self):
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = not self.has_next
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        if interaction.user.id != self.owner_id:
+            await interaction.response.send_message("Run /market yourself to page through trades.", ephemeral=True)
+            return False
+        return True
+
+    async def _show(self, interaction: discord.Interaction, page: int):
+        trades, self.has_next = await db.get_trades_page(after=self.cursors[page], limit=MARKET_PAGE_SIZE, **self.filters)
+        self.page = page
+        if trades:
+            cursor = (trades[-1][4], trades[-1][0])
+            del self.cursors[page + 1:]
+            self.cursors.append(cursor)
+        self._sync_buttons()
+        await interaction.response.edit_message(embed=build_market_embed(trades, page), view=self)
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, max(self.page - 1, 0))
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.primary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.page + 1)
+
 @bot.tree.command(name='market', description="Show all available trades.")
-async def market(interaction: discord.Interaction):
-    trades = await db.get_all_trades()  # Fetch all available trades from the database
+@app_commands.describe(company="(Optional) Only show this company", seller="(Optional) Only show this seller's trades", min_price="(Optional) Lowest price per share", max_price="(Optional) Highest price per share")
+@app_commands.autocomplete(company=company_autocomplete)
+@timed_command
+async def market(interaction: discord.Interaction, company: str = None, seller: discord.User = None, min_price: float = None, max_price: float = None):
+    filters = {
+        "company_name": company,
+        "seller_id": seller.id if seller else None,
+        "min_price": min_price,
+        "max_price": max_price
+    }
+    # Fetch one page of trades; the buttons fetch the rest on demand
+    trades, has_next = await db.get_trades_page(limit=MARKET_PAGE_SIZE, **filters)
 
     if not trades:
         await interaction.response.send_message("No trades available.")
         return
 
-    # Create an embed for displaying trades
-    embed = discord.Embed(title="Available Trades", color=discord.Color.blue())
+    view = MarketView(interaction.user.id, filters, has_next, (trades[-1][4], trades[-1][0]))
+    await interaction.response.send_message(embed=build_market_embed(trades, 0), view=view)
+
+HISTORY_PAGE_SIZE = 10
+# What a ledger entry's ref points at, by reason; fills and anything else refer to a trade
+REF_LABELS = {"dividend": "payout", "dividend_paid": "payout"}
+
+def build_history_embed(entries, page: int):
+    embed = discord.Embed(title="Transaction History", color=discord.Color.blue())
+    embed.set_footer(text=f"Page {page + 1}")
+    lines = []
+    for entry_id, ts, company_name, delta, reason, ref in entries:
+        asset = "credits" if not company_name else f"shares of {company_name}"
+        amount = f"{delta:+,.2f}" if not company_name else f"{delta:+,g}"
+        detail = f" ({REF_LABELS.get(reason, 'trade')} {ref})" if ref else ""
+        lines.append(f"<t:{ts}:f> `{reason}` {amount} {asset}{detail}")
+    embed.description = "\n".join(lines)
+    return embed
+
+class HistoryView(discord.ui.View):
+    def __init__(self, owner_id: int, has_next: bool, cursor: int):
+        super().__init__(timeout=180)
+        self.owner_id = owner_id
+        self.cursors = [None, cursor]  # Keyset cursor at the start of each page visited so far
+        self.page = 0
+        self.has_next = has_next
+        self._sync_buttons()
+
+    def _sync_buttons(self):
+        self.newer_page.disabled = self.page == 0
+        self.older_page.disabled = not self.has_next
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        if interaction.user.id != self.owner_id:
+            await interaction.response.send_message("Run /history yourself to see your own transactions.", ephemeral=True)
+            return False
+        return True
+
+    async def _show(self, interaction: discord.Interaction, page: int):
+        entries, self.has_next = await db.get_ledger_page(self.owner_id, before=self.cursors[page], limit=HISTORY_PAGE_SIZE)
+        self.page = page
+        if entries:
+            del self.cursors[page + 1:]
+            self.cursors.append(entries[-1][0])
+        self._sync_buttons()
+        await interaction.response.edit_message(embed=build_history_embed(entries, page), view=self)
+
+    @discord.ui.button(label="Newer", style=discord.ButtonStyle.secondary)
+    async def newer_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, max(self.page - 1, 0))
+
+    @discord.ui.button(label="Older", style=discord.ButtonStyle.primary)
+    async def older_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.page + 1)
+
+alert_group = app_commands.Group(name="alert", description="Get a DM when a company's share price crosses a level.")
+
+@alert_group.command(name="add", description="Get a DM when a company's share price crosses a price.")
+@app_commands.describe(company_name="Company to watch", price="Share price that triggers the alert")
+@app_commands.autocomplete(company_name=company_autocomplete)
+@timed_command
+async def alert_add(interaction: discord.Interaction, company_name: str, price: float):
+    try:
+        alert_id, direction, current = await db.add_alert(interaction.user.id, company_name, price)
+    except ValueError as e:
+        await interaction.response.send_message(str(e), ephemeral=True)
+        return
+    await interaction.response.send_message(
+        f"Alert #{alert_id} set: you'll get a DM when {company_name} goes {direction} {price:,} (now {current:,}).",
+        ephemeral=True
+    )
 
-    for trade in trades:
-        # Assuming the tuple is structured as (trade_id, seller_id, company_name, shares_available, price_per_share)
-        trade_id = trade[0]
-        seller_id = trade[1]
-        company_name = trade[2]
-        shares_available = trade[3]
-        price_per_share = round(trade[4],2)
+@alert_group.command(name="list", description="Show your price alerts.")
+@timed_command
+async def alert_list(interaction: discord.Interaction):
+    alerts = await db.get_user_alerts(interaction.user.id)
+    if not alerts:
+        await interaction.response.send_message("You have no price alerts.", ephemeral=True)
+        return
+    embed = discord.Embed(title="Your Price Alerts", color=discord.Color.blue())
+    embed.description = "\n".join(
+        f"**#{alert_id}** {company_name} {direction} {threshold:,} (set <t:{created_at}:R>)"
+        for alert_id, company_name, direction, threshold, created_at in alerts
+    )
+    embed.set_footer(text=f"{len(alerts)} of {MAX_ALERTS_PER_USER} alerts")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@alert_group.command(name="remove", description="Remove one of your price alerts.")
+@app_commands.describe(alert_id="ID of the alert, from /alert list")
+@timed_command
+async def alert_remove(interaction: discord.Interaction, alert_id: int):
+    if await db.remove_alert(interaction.user.id, alert_id):
+        await interaction.response.send_message(f"Alert #{alert_id} removed.", ephemeral=True)
+    else:
+        await interaction.response.send_message("Alert not found, or it isn't yours.", ephemeral=True)
 
-        embed.add_field(
-            name=f"Trade ID: {trade_id}",
-            value=(
-                f"**Seller ID:** {seller_id}\n"
-                f"**Company:** {company_name}\n"
-                f"**Shares Available:** {shares_available}\n"
-                f"**Price per Share:** ${price_per_share:,}"
-            ),
-            inline=False
-        )
+bot.tree.add_command(alert_group)
 
-    await interaction.response.send_message(embed=embed)
+dividend_group = app_commands.Group(name="dividend", description="Pay dividends to your company's shareholders.")
+
+@dividend_group.command(name="pay", description="Pay a dividend on every share held in your company.")
+@app_commands.describe(company_name="Your company", amount="Credits paid per share")
+@app_commands.autocomplete(company_name=company_autocomplete)
+@timed_command
+async def dividend_pay(interaction: discord.Interaction, company_name: str, amount: float):
+    try:
+        result = await db.pay_dividend(company_name, interaction.user.id, amount)
+    except ValueError as e:
+        await interaction.response.send_message(str(e), ephemeral=True)
+        return
+    log_dividend(result)
+    await interaction.response.send_message(
+        f"Paid {amount:,} per share on {result['shares']:,} shares of {company_name} "
+        f"to {result['holders']:,} holders, {result['total']:,} in total.",
+        ephemeral=True
+    )
+
+@dividend_group.command(name="schedule", description="Pay a dividend automatically at a fixed interval.")
+@app_commands.describe(company_name="Your company", amount="Credits paid per share", every_hours="Hours between payments")
+@app_commands.autocomplete(company_name=company_autocomplete)
+@timed_command
+async def dividend_schedule(interaction: discord.Interaction, company_name: str, amount: float, every_hours: int):
+    if not 1 <= every_hours <= 720:
+        await interaction.response.send_message("Payments can be from 1 to 720 hours apart.", ephemeral=True)
+        return
+    try:
+        payout_id, next_run = await db.schedule_payout(company_name, interaction.user.id, amount, every_hours * 3600)
+    except ValueError as e:
+        await interaction.response.send_message(str(e), ephemeral=True)
+        return
+    await interaction.response.send_message(
+        f"Payout #{payout_id} scheduled: {amount:,} per share of {company_name} every {every_hours}h, first <t:{next_run}:R>.",
+        ephemeral=True
+    )
+
+@dividend_group.command(name="list", description="Show your scheduled dividends.")
+@timed_command
+async def dividend_list(interaction: discord.Interaction):
+    payouts = await db.get_payouts(interaction.user.id)
+    if not payouts:
+        await interaction.response.send_message("You have no scheduled dividends.", ephemeral=True)
+        return
+    embed = discord.Embed(title="Scheduled Dividends", color=discord.Color.green())
+    embed.description = "\n".join(
+        f"**#{payout_id}** {company_name}: {amount:,} per share every {interval // 3600}h, next <t:{next_run}:R>"
+        for payout_id, company_name, amount, interval, next_run in payouts
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@dividend_group.command(name="cancel", description="Cancel one of your scheduled dividends.")
+@app_commands.describe(payout_id="ID of the payout, from /dividend list")
+@timed_command
+async def dividend_cancel(interaction: discord.Interaction, payout_id: int):
+    if await db.cancel_payout(payout_id, interaction.user.id):
+        await interaction.response.send_message(f"Payout #{payout_id} cancelled.", ephemeral=True)
+    else:
+        await interaction.response.send_message("Payout not found, or it isn't yours.", ephemeral=True)
+
+bot.tree.add_command(dividend_group)
+
+@bot.tree.command(name="history", description="Show your credit and share movements.")
+@timed_command
+async def history(interaction: discord.Interaction):
+    entries, has_next = await db.get_ledger_page(interaction.user.id, limit=HISTORY_PAGE_SIZE)
+    if not entries:
+        await interaction.response.send_message("No transactions recorded yet.", ephemeral=True)
+        return
+    view = HistoryView(interaction.user.id, has_next, entries[-1][0])
+    await interaction.response.send_message(embed=build_history_embed(entries, 0), view=view, ephemeral=True)
+
+@bot.tree.command(name="audit", description="Check balances against the transaction ledger (admin only).")
+@app_commands.describe(user="(Optional) Only audit this user", repair="Rewrite every balance from the ledger")
+@timed_command
+async def audit(interaction: discord.Interaction, user: discord.User = None, repair: bool = False):
+    if not any(role.id == AUTHORIZED_ROLE_ID for role in interaction.user.roles):
+        await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True)
+
+    if repair:
+        rebuilt = await db.rebuild_balances()
+        await interaction.followup.send(f"Rebuilt {rebuilt} balances from the ledger.", ephemeral=True)
+        return
+
+    mismatches = await db.audit_balances(user.id if user else None)
+    if not mismatches:
+        await interaction.followup.send("All balances match the ledger.", ephemeral=True)
+        return
+    lines = [
+        f"<@{user_id}> {'credits' if not company_name else company_name}: live {live:,} vs ledger {replayed:,}"
+        for user_id, company_name, live, replayed in mismatches[:15]
+    ]
+    if len(mismatches) > 15:
+        lines.append(f"...and {len(mismatches) - 15} more")
+    await interaction.followup.send(f"{len(mismatches)} balance(s) disagree with the ledger:\n" + "\n".join(lines), ephemeral=True)
+
+def describe_order(result, company: str, verb: str):
+    # Summarises a DatabaseUser.place_order result for the user
+    lines = []
+    if result["filled"]:
+        lines.append(f"{verb} {result['filled']} shares of {company} for ${result['total']:,} across {len(result['fills'])} fill(s).")
+    if result["resting_id"]:
+        lines.append(f"{result['remaining']} shares left on the book as trade ID {result['resting_id']}.")
+    elif result["remaining"]:
+        lines.append(f"{result['remaining']} shares could not be matched.")
+    return "\n".join(lines)
 
 @bot.tree.command(name="post_trade", description="Post a trade to sell shares on the market")
 @app_commands.describe(company="Company to sell shares from", shares="Number of shares", price="Price per share", to="(Optional) User to send a direct trade to")
+@app_commands.autocomplete(company=company_autocomplete)
+@timed_command
 async def post_trade(interaction: discord.Interaction, company: str, shares: int, price: float, to: discord.User = None):
     user_id = interaction.user.id
     
@@ -525,64 +930,86 @@ async def post_trade(interaction: discord.Interaction, company: str, shares: int
         return
 
     # If 'to' user is specified, it's a direct trade
-    to_user_id = to.id if to else None
-
-    # Post the trade in the market
-    await db.create_trade(company, user_id, shares, price, to_user_id)
-    
-    if to_user_id:
+    if to:
+        await db.create_trade(company, user_id, shares, price, to.id)
         await interaction.response.send_message(f"Direct trade posted: Selling {shares} shares of {company} at ${price:,} per share to {to.mention}.")
-    else:
-        await interaction.response.send_message(f"Trade posted: Selling {shares} shares of {company} at ${price:,} per share.")
+        return
 
-@bot.tree.command(name="buy_trade", description="Buy shares from the market")
-@app_commands.describe(trade_id="ID of the trade to buy", num_shares="Number of shares to buy")
-async def buy_trade(interaction: discord.Interaction, trade_id: int, num_shares: int):
-    buyer_id = interaction.user.id
-    
-    # Get the trade details from the database
-    trade = await db.get_trade(trade_id)
-    if not trade:
-        await interaction.response.send_message("Trade not found. Please check the trade ID.", ephemeral=True)
+    # Public asks match resting bids first; whatever is left rests on the book
+    try:
+        result = await db.place_order(user_id, company, "ask", shares, limit_price=price)
+    except ValueError as e:
+        await interaction.response.send_message(str(e), ephemeral=True)
         return
-    
-    company_name = trade['company_name']
-    shares_available = trade['shares_available']
-    price_per_share = trade['price_per_share']
-    seller_id = trade['seller_id']
-    to_user_id = trade['to_user_id']  # New field to specify the direct trade recipient
 
-    # If the trade is restricted to a specific user, check if the buyer is that user
-    if to_user_id and to_user_id != buyer_id:
-        await interaction.response.send_message(f"This trade is only available to <@{to_user_id}>.", ephemeral=True)
+    await interaction.response.send_message(f"Trade posted: Selling {shares} shares of {company} at ${price:,} per share.\n" + describe_order(result, company, "Sold"))
+
+@bot.tree.command(name="post_bid", description="Post a bid to buy shares on the market")
+@app_commands.describe(company="Company to buy shares in", shares="Number of shares", price="Highest price per share you will pay")
+@app_commands.autocomplete(company=company_autocomplete)
+@timed_command
+async def post_bid(interaction: discord.Interaction, company: str, shares: int, price: float):
+    try:
+        result = await db.place_order(interaction.user.id, company, "bid", shares, limit_price=price)
+    except ValueError as e:
+        await interaction.response.send_message(str(e), ephemeral=True)
+        return
+
+    await interaction.response.send_message(f"Bid posted: Buying {shares} shares of {company} at up to ${price:,} per share.\n" + describe_order(result, company, "Bought"))
+
+@bot.tree.command(name="market_buy", description="Buy shares from the best-priced market trades")
+@app_commands.describe(company="Company to buy shares in", shares="Number of shares", max_price="(Optional) Highest price per share you will pay")
+@app_commands.autocomplete(company=company_autocomplete)
+@timed_command
+async def market_buy(interaction: discord.Interaction, company: str, shares: int, max_price: float = None):
+    try:
+        result = await db.place_order(interaction.user.id, company, "bid", shares, limit_price=max_price, rest=False)
+    except ValueError as e:
+        await interaction.response.send_message(str(e), ephemeral=True)
         return
 
-    # Check if the requested number of shares is available
-    if num_shares > shares_available:
-        await interaction.response.send_message(f"Not enough shares available. Only {shares_available} shares are left.", ephemeral=True)
+    if not result["filled"]:
+        await interaction.response.send_message(f"No matching trades available for {company}.", ephemeral=True)
         return
+    await interaction.response.send_message(describe_order(result, company, "Bought"), ephemeral=True)
 
-    total_price = num_shares * price_per_share
+@bot.tree.command(name="market_sell", description="Sell shares to the best-priced market bids")
+@app_commands.describe(company="Company to sell shares of", shares="Number of shares", min_price="(Optional) Lowest price per share you will accept")
+@app_commands.autocomplete(company=company_autocomplete)
+@timed_command
+async def market_sell(interaction: discord.Interaction, company: str, shares: int, min_price: float = None):
+    try:
+        result = await db.place_order(interaction.user.id, company, "ask", shares, limit_price=min_price, rest=False)
+    except ValueError as e:
+        await interaction.response.send_message(str(e), ephemeral=True)
+        return
 
-    # Check if the buyer has enough credits
-    buyer_credits = await db.get_user_credits(buyer_id)
-    if buyer_credits < total_price:
-        await interaction.response.send_message(f"You don't have enough credits to buy {num_shares} shares of {company_name}. Total cost is ${total_price:,}.", ephemeral=True)
+    if not result["filled"]:
+        await interaction.response.send_message(f"No matching bids available for {company}.", ephemeral=True)
         return
-    
-    # Transfer credits and shares
-    await db.transfer_credits(buyer_id, seller_id, total_price)  # Transfer credits from buyer to seller
-    await db.transfer_shares(seller_id, buyer_id, company_name, num_shares)  # Transfer shares from seller to buyer
-
-    # Update or remove the trade from the market
-    remaining_shares = shares_available - num_shares
-    if remaining_shares > 0:
-        # Update the trade to reflect the new number of available shares
-        await db.update_trade(trade_id, remaining_shares)
+    await interaction.response.send_message(describe_order(result, company, "Sold"), ephemeral=True)
+
+@bot.tree.command(name="cancel_trade", description="Cancel one of your open trades or bids")
+@app_commands.describe(trade_id="ID of the trade to cancel")
+@timed_command
+async def cancel_trade(interaction: discord.Interaction, trade_id: int):
+    if await db.cancel_order(trade_id, interaction.user.id):
+        await interaction.response.send_message(f"Trade {trade_id} cancelled.", ephemeral=True)
     else:
-        # Remove the trade from the market if no shares are left
-        await db.delete_trade(trade_id)
+        await interaction.response.send_message("Trade not found, or it isn't yours.", ephemeral=True)
+
+@bot.tree.command(name="buy_trade", description="Buy shares from the market")
+@app_commands.describe(trade_id="ID of the trade to buy", num_shares="Number of shares to buy")
+@timed_command
+async def buy_trade(interaction: discord.Interaction, trade_id: int, num_shares: int):
+    # Checks, credit/share transfer and the listing update settle in one transaction
+    try:
+        trade = await db.fill_trade(trade_id, interaction.user.id, num_shares)
+    except ValueError as e:
+        await interaction.response.send_message(str(e), ephemeral=True)
+        return
 
-    await interaction.response.send_message(f"Successfully bought {num_shares} shares of {company_name} from <@{seller_id}> for ${total_price:,}.", ephemeral=True)
+    await interaction.response.send_message(f"Successfully bought {num_shares} shares of {trade['company_name']} from <@{trade['seller_id']}> for ${trade['total']:,}.", ephemeral=True)
 
-bot.run(TOKEN)
+if __name__ == "__main__":
+    bot.run(TOKEN)
@@ -0,0 +1,149 @@
+import asyncio
+import bisect
+import functools
+import inspect
+import time
+from aiohttp import web
+
+# Latency buckets in seconds, shared by every histogram
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float):
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class Metrics:
+    def __init__(self):
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.counters = {}  # (name, labels) -> float
+        self.gauges = {}  # (name, labels) -> float
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def remove(self, name: str, **labels):
+        # Drops the series name{labels}, whatever its type, e.g. once its subject is gone
+        key = (name, tuple(sorted(labels.items())))
+        for series in (self.histograms, self.counters, self.gauges):
+            series.pop(key, None)
+
+    def timed(self, name: str, label: str):
+        # Decorator recording a coroutine's wall time under name{label=<function name>}
+        def decorator(func):
+            labels = {label: func.__name__}
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    self.inc(f"{name}_errors_total", **labels)
+                    raise
+                finally:
+                    self.observe(name, time.perf_counter() - start, **labels)
+            return wrapper
+        return decorator
+
+    def instrument(self, name: str, label: str = "method"):
+        # Class decorator timing every public coroutine method
+        def decorator(cls):
+            for attr, value in list(vars(cls).items()):
+                if not attr.startswith("_") and inspect.iscoroutinefunction(value):
+                    setattr(cls, attr, self.timed(name, label)(value))
+            return cls
+        return decorator
+
+    def summary(self, name: str):
+        # {label value: histogram} for one metric, for /stats
+        return {labels[0][1] if labels else "": histogram
+                for (metric, labels), histogram in self.histograms.items() if metric == name}
+
+    async def sample_loop_lag(self, interval: float = 0.5):
+        # How late the event loop wakes us up is the time it spent blocked on something else
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - start - interval)
+            self.set_gauge("event_loop_lag_seconds", lag)
+            self.observe("event_loop_lag_seconds_histogram", lag)
+
+    def render_prometheus(self):
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), value in sorted(self.gauges.items()):
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+
+    async def serve(self, host: str, port: int):
+        async def handle(request):
+            return web.Response(text=self.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+# Process-wide registry
+metrics = Metrics()
+timed_command = metrics.timed("command_seconds", "command")
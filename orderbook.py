@@ -0,0 +1,58 @@
+import heapq
+
+ASK = "ask"
+BID = "bid"
+
+
+class Order:
+    __slots__ = ("trade_id", "user_id", "company_name", "side", "price", "shares")
+
+    def __init__(self, trade_id: int, user_id: str, company_name: str, side: str, price: float, shares: int):
+        self.trade_id = trade_id
+        self.user_id = str(user_id)
+        self.company_name = company_name
+        self.side = side
+        self.price = price
+        self.shares = shares
+
+    def key(self):
+        # Heap key: best price first, then the oldest trade_id (price-time priority)
+        return (self.price if self.side == ASK else -self.price, self.trade_id)
+
+
+class OrderBook:
+    def __init__(self, company_name: str):
+        self.company_name = company_name
+        self.orders = {}  # trade_id -> live Order
+        self._heaps = {ASK: [], BID: []}  # Order.key() entries; cancelled ids are skipped lazily
+
+    def add(self, order: Order):
+        self.orders[order.trade_id] = order
+        heapq.heappush(self._heaps[order.side], order.key())
+
+    def remove(self, trade_id: int):
+        return self.orders.pop(trade_id, None)
+
+    def _clean(self, side: str):
+        heap = self._heaps[side]
+        while heap and heap[0][1] not in self.orders:
+            heapq.heappop(heap)
+        return heap
+
+    def best(self, side: str):
+        heap = self._clean(side)
+        return self.orders[heap[0][1]] if heap else None
+
+    def pop_best(self, side: str):
+        heap = self._clean(side)
+        if not heap:
+            return None
+        _, trade_id = heapq.heappop(heap)
+        return self.orders[trade_id]
+
+    def restore(self, order: Order):
+        # Put back an order taken with pop_best, keeping its original time priority
+        heapq.heappush(self._heaps[order.side], order.key())
+
+    def depth(self, side: str):
+        return sum(1 for order in self.orders.values() if order.side == side)
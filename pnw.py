@@ -0,0 +1,100 @@
+import asyncio
+import collections
+import json
+import time
+import aiohttp
+
+DEFAULT_API_URL = "https://api.politicsandwar.com/graphql"
+
+
+class PnWClient:
+    def __init__(self, api_key: str, base_url: str = DEFAULT_API_URL, ttl: float = 300, connections: int = 10, max_cached: int = 1024):
+        self.api_key = api_key
+        self.base_url = base_url  # Point at a local stub server in tests
+        self.ttl = ttl
+        self.connections = connections
+        self.max_cached = max_cached
+        self._session = None
+        # query key -> (expires_at, nations), oldest first. Every entry gets the same ttl,
+        # so insertion order is also expiry order and stale entries are always at the front.
+        self._cache = collections.OrderedDict()
+        self._inflight = {}  # query key -> Future shared by identical concurrent lookups
+
+    async def _get_session(self):
+        # Created lazily so it binds to the running event loop; reused for connection pooling
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connections),
+                timeout=aiohttp.ClientTimeout(total=10)
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def query_nations(self, filters: dict, fields: str):
+        key = (json.dumps(filters, sort_keys=True), fields)
+
+        cached = self._cache.get(key)
+        if cached:
+            if cached[0] > time.monotonic():
+                return cached[1]
+            del self._cache[key]
+
+        # Single-flight: identical lookups already on the wire share one request
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            inflight = asyncio.ensure_future(self._fetch_nations(key, filters, fields))
+            self._inflight[key] = inflight
+            inflight.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(inflight)
+
+    async def _fetch_nations(self, key, filters: dict, fields: str):
+        arguments = ", ".join(f"{name}: [{json.dumps(value)}]" for name, value in filters.items())
+        query = f"{{ nations({arguments}, first: 1) {{ data {{ {fields} }} }} }}"
+
+        session = await self._get_session()
+        try:
+            async with session.post(self.base_url, params={"api_key": self.api_key}, json={"query": query}) as response:
+                response.raise_for_status()
+                payload = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            # ValueError covers a body that isn't JSON at all
+            print(f"PnW API request failed: {e}")
+            return []  # Failures are not cached
+
+        if isinstance(payload, dict) and payload.get("errors"):
+            print(f"PnW API returned errors: {payload['errors']}")
+            return []
+
+        try:
+            nations = payload["data"]["nations"]["data"]
+        except (KeyError, TypeError):
+            nations = None
+        if not isinstance(nations, list):
+            # e.g. {"data": null}; treated like a failed request
+            print(f"PnW API returned an unexpected payload: {str(payload)[:200]}")
+            return []
+        self._store(key, nations)
+        return nations
+
+    def _store(self, key, nations):
+        now = time.monotonic()
+        self._cache.pop(key, None)
+        self._cache[key] = (now + self.ttl, nations)
+        # Drop what has expired, then the oldest entries past the cap
+        while self._cache:
+            oldest_key, (expires_at, _) = next(iter(self._cache.items()))
+            if expires_at > now and len(self._cache) <= self.max_cached:
+                break
+            del self._cache[oldest_key]
+
+    async def nation_by_id(self, nation_id: int):
+        nations = await self.query_nations({"id": int(nation_id)}, "id nation_name discord")
+        return nations[0] if nations else None
+
+    async def nation_by_name(self, nation_name: str):
+        nations = await self.query_nations({"nation_name": nation_name}, "id nation_name discord")
+        return nations[0] if nations else None
@@ -0,0 +1,88 @@
+import asyncio
+import contextlib
+import aiosqlite
+
+# Pragmas applied to every pooled connection. WAL lets the readers run while
+# the writer commits, and NORMAL sync is durable in WAL mode.
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 134217728",
+)
+
+
+class ConnectionPool:
+    def __init__(self, db_name: str, readers: int = 4, statement_cache: int = 256):
+        self.db_name = db_name
+        self.size = readers
+        self.statement_cache = statement_cache  # Prepared statements kept per connection
+        self._writer = None
+        self._readers = None
+        self._connections = []
+        self._write_lock = asyncio.Lock()
+
+    @property
+    def is_open(self):
+        return self._writer is not None
+
+    async def _connect(self):
+        # Autocommit mode: transactions are opened explicitly by writer()
+        conn = await aiosqlite.connect(self.db_name, isolation_level=None, cached_statements=self.statement_cache)
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        self._connections.append(conn)
+        return conn
+
+    async def open(self):
+        if self.is_open:
+            return
+        # The writer is opened first so WAL mode is set before the readers attach
+        self._writer = await self._connect()
+        self._readers = asyncio.Queue()
+        for _ in range(self.size):
+            self._readers.put_nowait(await self._connect())
+
+    async def close(self):
+        if not self.is_open:
+            return
+        # Wait for the in-flight write to finish before tearing down
+        async with self._write_lock:
+            for conn in self._connections:
+                await conn.close()
+            self._connections = []
+            self._writer = None
+            self._readers = None
+
+    @contextlib.asynccontextmanager
+    async def reader(self):
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    async def executescript(self, script: str):
+        # For scripts that open and commit their own transaction (BEGIN ... COMMIT)
+        async with self._write_lock:
+            try:
+                await self._writer.executescript(script)
+            except BaseException:
+                if self._writer.in_transaction:
+                    await self._writer.rollback()
+                raise
+
+    @contextlib.asynccontextmanager
+    async def writer(self):
+        # A single writer connection; every block runs as one IMMEDIATE transaction
+        async with self._write_lock:
+            await self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            else:
+                await self._writer.commit()
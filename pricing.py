@@ -0,0 +1,45 @@
+SLICE_SHARES = 50  # Price impact is applied after every slice of this many shares
+IMPACT_EXPONENT = 1.2
+MIN_PRICE = 0.01
+
+
+def quote(share_price: float, total_shares: int, num_shares: int, side: str, slice_size: int = SLICE_SHARES):
+    # Cost of an N-share order executed as consecutive slices, each at the price left by the
+    # previous one: price *= 1 +/- (slice / available) ** 1.2, computed in one vectorized pass.
+    # An order of up to one slice costs exactly what the single-shot formula charged.
+    import numpy as np  # Deferred to the first quote to keep startup fast
+    share_price = round(float(share_price), 2)
+    full, rest = divmod(num_shares, slice_size)
+    sizes = np.full(full + (1 if rest else 0), slice_size, dtype=float)
+    if rest:
+        sizes[-1] = rest
+
+    # Shares available to the market when each slice starts
+    done = np.concatenate(([0.0], np.cumsum(sizes)[:-1]))
+    if side == "buy":
+        available = total_shares - done
+        sign = 1.0
+    elif side == "sell":
+        available = total_shares + done
+        sign = -1.0
+    else:
+        raise ValueError(f"Unknown trade side: {side}")
+
+    with np.errstate(divide="ignore"):
+        impact = (sizes / available) ** IMPACT_EXPONENT
+    factors = np.clip(1.0 + sign * impact, 0.0, None)
+    growth = np.cumprod(factors)
+
+    # Price each slice executes at, and the price after the last one
+    prices = np.maximum(share_price * np.concatenate(([1.0], growth[:-1])), MIN_PRICE)
+    costs = np.round(sizes * prices, 2)
+    total = round(float(costs.sum()), 2)
+
+    return {
+        "total": total,
+        "average_price": round(total / num_shares, 2) if num_shares else 0.0,
+        "share_price": share_price,
+        "new_price": max(round(float(share_price * growth[-1]), 2), MIN_PRICE) if len(growth) else share_price,
+        "new_shares": total_shares - num_shares if side == "buy" else total_shares + num_shares,
+        "slices": len(sizes)
+    }
@@ -0,0 +1,103 @@
+import numpy as np
+
+RING_MINUTES = 1440  # The longest period served from memory (1d)
+HEADROOM = 60  # Extra slots so a view handed to a chart render isn't overwritten for an hour of ticks
+
+
+def fill_steps(timestamps, prices, start_ts: int, end_ts: int, max_gap: int, step: int = 60):
+    # Rebuilds a regular minute series from change-only rows. Each grid point takes the newest
+    # row at or before it, unless that row is more than max_gap old: with keyframes written at
+    # least that often, a longer silence means nothing was being recorded, so it stays a gap.
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    prices = np.asarray(prices, dtype=np.float64)
+    grid = np.arange(-(-start_ts // step) * step, end_ts + 1, step, dtype=np.int64)
+    index = np.searchsorted(timestamps, grid, side="right") - 1
+    valid = index >= 0
+    valid[valid] = grid[valid] - timestamps[index[valid]] <= max_gap
+    return grid[valid], prices[index[valid]]
+
+
+class PriceRing:
+    # Fixed-size (ts, price) ring for one company. Every value is written twice, at i and
+    # i + capacity, so the newest n points are always one contiguous slice: reads are views.
+    def __init__(self, capacity: int = RING_MINUTES + HEADROOM):
+        self.capacity = capacity
+        self.ts = np.zeros(2 * capacity, dtype=np.int64)
+        self.prices = np.zeros(2 * capacity, dtype=np.float64)
+        self.count = 0  # Points ever appended
+
+    def append(self, ts: int, price: float):
+        if self.count and ts <= self.last_ts:
+            return  # Ticks only move forward; a repeated minute is ignored
+        i = self.count % self.capacity
+        self.ts[i] = self.ts[i + self.capacity] = ts
+        self.prices[i] = self.prices[i + self.capacity] = price
+        self.count += 1
+
+    def load(self, timestamps, prices):
+        # Bulk fill of an empty ring from ascending history, e.g. at warm-up
+        timestamps = np.asarray(timestamps, dtype=np.int64)[-self.capacity:]
+        prices = np.asarray(prices, dtype=np.float64)[-self.capacity:]
+        n = len(timestamps)
+        self.ts[:n] = self.ts[self.capacity:self.capacity + n] = timestamps
+        self.prices[:n] = self.prices[self.capacity:self.capacity + n] = prices
+        self.count = n
+
+    @property
+    def last_ts(self):
+        return int(self.ts[(self.count - 1) % self.capacity])
+
+    @property
+    def oldest_ts(self):
+        # Oldest point still held, or None while the ring has never wrapped
+        if self.count <= self.capacity:
+            return None
+        return int(self.ts[self.count % self.capacity])
+
+    def latest(self, n: int = None):
+        # Views of the newest n points, oldest first
+        size = min(self.count, self.capacity)
+        n = size if n is None else min(n, size)
+        end = (self.count - 1) % self.capacity + self.capacity + 1
+        return self.ts[end - n:end], self.prices[end - n:end]
+
+    def since(self, start_ts: int, step: int = 1):
+        # Points at or after start_ts; step > 1 keeps every step-th point counting back from the newest
+        timestamps, prices = self.latest()
+        first = int(np.searchsorted(timestamps, start_ts, side="left"))
+        timestamps, prices = timestamps[first:], prices[first:]
+        if step > 1:
+            offset = (len(timestamps) - 1) % step
+            timestamps, prices = timestamps[offset::step], prices[offset::step]
+        return timestamps, prices
+
+
+class PriceRings:
+    def __init__(self, horizon: int):
+        # Nothing before horizon was loaded; older ranges still have to come from SQLite
+        self.horizon = horizon
+        self.rings = {}  # company_name -> PriceRing
+
+    def load(self, company_name: str, timestamps, prices):
+        ring = self.rings[company_name] = PriceRing()
+        ring.load(timestamps, prices)
+
+    def append(self, ts: int, prices):
+        for company_name, price in prices:
+            ring = self.rings.get(company_name)
+            if ring is None:
+                ring = self.rings[company_name] = PriceRing()
+            ring.append(ts, price)
+
+    def covers(self, company_name: str, start_ts: int):
+        ring = self.rings.get(company_name)
+        if ring is None or start_ts < self.horizon:
+            return False
+        oldest = ring.oldest_ts
+        return oldest is None or start_ts >= oldest
+
+    def since(self, company_name: str, start_ts: int, step: int = 1):
+        return self.rings[company_name].since(start_ts, step)
+
+    def discard(self, company_name: str):
+        self.rings.pop(company_name, None)
@@ -0,0 +1,72 @@
+import asyncio
+import io
+import json
+import discord
+from ratelimit import TokenBucket
+from batching import BatchWorker
+
+MESSAGE_LIMIT = 2000  # Discord message length limit
+
+
+def format_transaction(entry: dict):
+    transaction_type = entry["type"]
+    if transaction_type == "Dividend":
+        return (
+            "Dividend Log:\n"
+            f"Payer ID: {entry['user_id']}\n"
+            f"Company: {entry['company']}\n"
+            f"Per Share: {entry['share_price']}\n"
+            f"Shares Paid: {entry['shares']} across {entry['holders']} holders\n"
+            f"Total Paid: {entry['total']}\n"
+            f"Time: {entry['time']}"
+        )
+    return (
+        f"{transaction_type} Transaction Log:\n"
+        f"User ID: {entry['user_id']}\n"
+        f"Company: {entry['company']}\n"
+        f"Shares {transaction_type}d: {entry['shares']}\n"
+        f"Share Price: {entry['share_price']}\n"
+        f"Total {transaction_type} Value: {entry['total']}\n"
+        f"Time: {entry['time']}"
+    )
+
+
+class TransactionLogger:
+    def __init__(self, get_channel, ledger_path: str, batch_size: int = 25, flush_interval: float = 2.0, rate: TokenBucket = None):
+        self.get_channel = get_channel  # Resolved per batch; the channel may not be cached at startup
+        self.ledger_path = ledger_path
+        self.rate = rate or TokenBucket(5, 5.0)  # Stay inside the channel's send rate limit
+        self.worker = BatchWorker(self._flush, batch_size, flush_interval, "write transaction log batch")
+
+    def start(self):
+        self.worker.start()
+
+    async def stop(self):
+        await self.worker.stop()
+
+    def log(self, entry: dict):
+        # All a trade handler pays for: the batch is written and sent by the worker
+        self.worker.put(entry)
+
+    async def _flush(self, batch):
+        await asyncio.to_thread(self._append_ledger, batch)
+        await self._send(batch)
+
+    def _append_ledger(self, batch):
+        with open(self.ledger_path, "a", encoding="utf-8") as ledger:
+            ledger.write("".join(json.dumps(entry) + "\n" for entry in batch))
+
+    async def _send(self, batch):
+        log_channel = self.get_channel()
+        if not log_channel:
+            print(f"Log channel not found; {len(batch)} transaction(s) kept in {self.ledger_path} only.")
+            return
+
+        content = "\n\n".join(format_transaction(entry) for entry in batch)
+        await self.rate.acquire()
+        if len(content) <= MESSAGE_LIMIT:
+            await log_channel.send(content)
+        else:
+            # Too long for one message: attach the whole batch as a file instead
+            file = discord.File(fp=io.BytesIO(content.encode("utf-8")), filename="transactions.txt")
+            await log_channel.send(f"{len(batch)} transactions", file=file)